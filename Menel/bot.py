@@ -1,22 +1,45 @@
+import asyncio
+import contextlib
 import datetime
 import logging
 import pkgutil
+from collections import Counter
+from os import environ
+from pathlib import Path
+from time import perf_counter
 from types import ModuleType
-from typing import Union
+from typing import Iterable, Optional, Union
 
 import discord
-import httpx
+import pymongo.errors
+from aiohttp import web
 from discord.ext import commands
+from discord.state import AutoShardedConnectionState
 
 from .utils import error_handlers
+from .utils.browser import BrowserPool
+from .utils.cache import MISSING, LRUCache, SingleFlight
 from .utils.context import Context
 from .utils.database import Database
 from .utils.help_command import HelpCommand
+from .utils.http_clients import HTTPClients
+from .utils.message_cache import MessageCache, MessageCacheState, supports_message_cache
+from .utils.metrics import Metrics
+from .utils.prefixes import PrefixMatcher
+from .utils.redirects import RedirectResolver
+from .utils.response_cache import ResponseCache
+from .utils.temp_files import TempFiles
 from .utils.text_tools import ctx_location, name_id
+from .utils.uploads import UploadCache
+from .utils.workers import ProcessPool
 
 log = logging.getLogger(__name__)
 
 
+class ConnectionState(MessageCacheState, AutoShardedConnectionState):
+    pass
+
+
 class Menel(commands.AutoShardedBot):
     db: Database
     on_command_error = staticmethod(error_handlers.command_error)
@@ -28,7 +51,7 @@ class Menel(commands.AutoShardedBot):
             owner_id=724674729977577643,
             help_command=HelpCommand(),
             strip_after_prefix=True,
-            max_messages=5 * 1024,
+            max_messages=int(environ.get("MESSAGE_CACHE_SIZE", 5 * 1024)),
             intents=discord.Intents(messages=True, guilds=True, members=True, reactions=True),
             member_cache_flags=discord.MemberCacheFlags(joined=True, voice=False),
             chunk_guilds_at_startup=False,
@@ -38,47 +61,187 @@ class Menel(commands.AutoShardedBot):
         )
 
         self.global_rate_limit = commands.CooldownMapping.from_cooldown(5, 12, commands.BucketType.user)
+        # how far messages got in process_commands
+        self.message_stats: Counter[str] = Counter()
+        self.metrics = Metrics()
+        self.metrics.collectors.append(self.collect_metrics)
+        self._metrics_runner: Optional[web.AppRunner] = None
         self.prefix_base = []
+        self.mention_prefixes = PrefixMatcher(self.prefix_base)
+        # message id -> prefix already matched by process_commands, so get_context doesn't match it again
+        self._prefixes: dict[int, str] = {}
         self.db = Database()
-        self.client = httpx.AsyncClient(timeout=httpx.Timeout(10))
+        self.http_clients = HTTPClients()
+        self.client = self.http_clients["default"]
+        cache_path = environ.get("RESPONSE_CACHE_PATH")
+        self.responses = ResponseCache(path=Path(cache_path) if cache_path else None)
+        self.redirects = RedirectResolver(self.client)
+        # results of REST calls for messages and channels which aren't in the cache of discord.py
+        self.fetched_messages = LRUCache(max_size=1024, ttl=2 * 60)
+        self.fetched_channels = LRUCache(max_size=1024, ttl=10 * 60)
+        self.fetches = SingleFlight()
+        self.uploads = UploadCache(self.db)
+        self.browser_pool = BrowserPool()
+        self._browser_start: Optional[asyncio.Task] = None
+        self.process_pool = ProcessPool(preload=("Menel.utils.rendering",))
+        self.temp_files = TempFiles()
+        self.temp_files.cleanup()
 
         from . import cogs
 
         self.load_extensions(cogs)
 
-    async def get_prefix(self, m: Union[discord.Message, Context]) -> list[str]:
-        return self.prefix_base + await self.db.get_prefixes(m.guild)
+    def _get_state(self, **options) -> ConnectionState:
+        state = super()._get_state(**options)
+        message_cache = MessageCache(
+            options["max_messages"], max_guild_messages=int(environ.get("MESSAGE_CACHE_GUILD_SIZE", 1024))
+        )
+        if not supports_message_cache(state):
+            # only used for the statistics then
+            log.warning("The connection state of this discord.py version can't use MessageCache")
+            state.message_cache = message_cache
+            return state
+
+        # discord.py has no way to replace its message deque, so the state gets a class which redirects it,
+        # this relies on private attributes of ConnectionState, see MessageCacheState
+        del state._messages
+        state.__class__ = ConnectionState
+        state.message_cache = message_cache
+        return state
+
+    @property
+    def message_cache(self) -> MessageCache:
+        return self._connection.message_cache
+
+    async def login(self, token: str) -> None:
+        await super().login(token)
+        await self.db.load_blacklist()
+        await self.db.create_indexes()
+        await self.responses.load()
+        self._browser_start = asyncio.create_task(self.browser_pool.start())
+        if environ.get("DB_WATCH_CHANGES"):
+            log.info("Watching database changes")
+            self.db.watch()
+        if (port := environ.get("METRICS_PORT")) and self._metrics_runner is None:
+            log.info(f"Serving metrics on port {port}")
+            self._metrics_runner = await self.metrics.serve(int(port))
+
+    async def get_prefix(self, m: discord.Message) -> Union[str, tuple]:
+        prefix = self._prefixes.get(m.id)
+        if prefix is None:
+            prefix = await self._match_prefix(m)
+        # an empty tuple makes discord.py reject the message without building a list of prefixes
+        return prefix if prefix is not None else ()
+
+    # guilds can set an empty prefix, so only None means that the message has no prefix
+    async def _match_prefix(self, m: discord.Message) -> Optional[str]:
+        content = m.content
+        prefix = self.mention_prefixes.match(content)
+        if prefix is None:
+            prefix = (await self.db.get_prefix_matcher(m.guild)).match(content)
+        return prefix
 
     async def process_commands(self, m: discord.Message):
+        stats = self.message_stats
         if m.author.bot:
+            stats["bot"] += 1
+            return
+
+        # cheap enough to reject most messages before computing permissions or creating a Context
+        prefix = await self._match_prefix(m)
+        if prefix is None:
+            stats["no_prefix"] += 1
             return
 
-        if m.author.id in await self.db.get_blacklist():
+        if self.db.is_blacklisted(m.author.id):
+            stats["blacklisted"] += 1
             return
 
         if m.guild and not m.channel.permissions_for(m.guild.me).send_messages:
+            stats["no_permissions"] += 1
             return
 
-        ctx = await self.get_context(m, cls=Context)
+        self._prefixes[m.id] = prefix
+        try:
+            ctx = await self.get_context(m, cls=Context)
+        finally:
+            self._prefixes.pop(m.id, None)
 
         if not ctx.command:
+            stats["no_command"] += 1
             return
 
         if self.global_rate_limit.update_rate_limit(ctx.message, ctx.command_time.timestamp()):
+            stats["rate_limited"] += 1
             log.warning(f"Rate limit exceeded by {ctx_location(ctx)}")
             return
 
+        stats["command"] += 1
         log.info(f"Running command {ctx.command.qualified_name} for {ctx_location(ctx)}")
         await self.invoke(ctx)
 
+    async def invoke(self, ctx: Context):
+        if ctx.command is None:
+            await super().invoke(ctx)
+            return
+
+        metrics = self.metrics.commands[ctx.command.qualified_name]
+        metrics.start()
+        try:
+            await super().invoke(ctx)
+        finally:
+            metrics.stop(perf_counter() - ctx.perf_start, failed=ctx.command_failed)
+
+    def collect_metrics(self) -> Iterable[tuple[str, float]]:
+        for stage, count in self.message_stats.items():
+            yield f'menel_messages_total{{stage="{stage}"}}', count
+
+        for name, collection_cache in self.db.caches().items():
+            cache = collection_cache.cache
+            yield f'menel_cache_entries{{cache="{name}"}}', len(cache)
+            yield f'menel_cache_bytes{{cache="{name}"}}', cache.bytes
+            yield f'menel_cache_hits_total{{cache="{name}"}}', cache.stats.hits
+            yield f'menel_cache_misses_total{{cache="{name}"}}', cache.stats.misses
+            yield f'menel_cache_evictions_total{{cache="{name}"}}', cache.stats.evictions
+            yield f'menel_cache_coalesced_total{{cache="{name}"}}', collection_cache.lookups.saved
+
+        cache = self.responses.cache
+        yield 'menel_cache_entries{cache="responses"}', len(cache)
+        yield 'menel_cache_bytes{cache="responses"}', cache.bytes
+        yield 'menel_cache_hits_total{cache="responses"}', cache.stats.hits
+        yield 'menel_cache_misses_total{cache="responses"}', cache.stats.misses
+        yield 'menel_cache_evictions_total{cache="responses"}', cache.stats.evictions
+        yield 'menel_cache_coalesced_total{cache="responses"}', self.responses.lookups.saved
+
+        for name, cache in ("fetched_messages", self.fetched_messages), ("fetched_channels", self.fetched_channels):
+            yield f'menel_cache_entries{{cache="{name}"}}', len(cache)
+            yield f'menel_cache_hits_total{{cache="{name}"}}', cache.stats.hits
+            yield f'menel_cache_misses_total{{cache="{name}"}}', cache.stats.misses
+        yield 'menel_cache_coalesced_total{cache="fetches"}', self.fetches.saved
+
+        message_cache = self.message_cache
+        yield "menel_message_cache_messages", len(message_cache)
+        yield "menel_message_cache_guilds", message_cache.guilds
+        yield "menel_message_cache_evictions_total", message_cache.evictions
+        for (source, result), count in message_cache.lookups.items():
+            yield f'menel_message_cache_lookups_total{{source="{source}",result="{result}"}}', count
+
+        yield "menel_process_pool_jobs", self.process_pool.jobs
+
     async def on_connect(self):
         log.info(f"Connected as {name_id(self.user)}")
         self.prefix_base = [f"<@{self.user.id}>", f"<@!{self.user.id}>"]
+        self.mention_prefixes = PrefixMatcher(self.prefix_base)
 
     @staticmethod
     async def on_shard_connect(shard_id: int):
         log.debug(f"Connected on shard {shard_id}")
 
+    async def on_shard_ready(self, shard_id: int):
+        guild_ids = [g.id for g in self.guilds if g.shard_id == shard_id]
+        await self.db.prefetch_guild_configs(guild_ids)
+        log.debug(f"Prefetched configs of {len(guild_ids)} servers on shard {shard_id}")
+
     @staticmethod
     async def on_ready():
         log.info("Cache ready")
@@ -98,22 +261,60 @@ class Menel(commands.AutoShardedBot):
 
         await self.process_commands(after)
 
-    @staticmethod
-    async def on_guild_join(guild: discord.Guild):
+    async def on_raw_message_edit(self, payload: discord.RawMessageUpdateEvent):
+        # on_message_edit only fires for cached messages, so commands in the other ones aren't reprocessed
+        self.message_cache.record("edit", payload.cached_message is not None)
+        self.fetched_messages.pop(payload.message_id)
+
+    async def on_raw_message_delete(self, payload: discord.RawMessageDeleteEvent):
+        self.fetched_messages.pop(payload.message_id)
+
+    async def on_raw_bulk_message_delete(self, payload: discord.RawBulkMessageDeleteEvent):
+        for message_id in payload.message_ids:
+            self.fetched_messages.pop(message_id)
+
+    async def on_guild_join(self, guild: discord.Guild):
         log.info(f"Joined server {guild}")
+        await self.db.prefetch_guild_configs([guild.id])
 
     @staticmethod
     async def on_guild_remove(guild: discord.Guild):
         log.info(f"Left server {guild}")
 
+    async def _fetch_channel(
+        self, id: int
+    ) -> Union[discord.abc.GuildChannel, discord.abc.PrivateChannel, discord.Thread]:
+        channel = await self.fetch_channel(id)
+        self.fetched_channels.set(id, channel)
+        return channel
+
     async def get_or_fetch_channel(
         self, id: int, /
     ) -> Union[discord.abc.GuildChannel, discord.abc.PrivateChannel, discord.Thread]:
-        return self.get_channel(id) or await self.fetch_channel(id)
+        if (channel := self.get_channel(id)) is not None:
+            return channel
 
-    async def fetch_message(self, channel_id: int, message_id: int, /) -> discord.Message:
+        channel = self.fetched_channels.get(id)
+        if channel is MISSING:
+            channel = await self.fetches.run(("channel", id), lambda: self._fetch_channel(id))
+        return channel
+
+    async def _fetch_message(self, channel_id: int, message_id: int) -> discord.Message:
         channel = await self.get_or_fetch_channel(channel_id)
-        return await channel.fetch_message(message_id)  # type: ignore
+        message = await channel.fetch_message(message_id)  # type: ignore
+        self.fetched_messages.set(message_id, message)
+        return message
+
+    async def fetch_message(self, channel_id: int, message_id: int, /) -> discord.Message:
+        if (message := self.message_cache.get(message_id)) is not None:
+            return message
+
+        message = self.fetched_messages.get(message_id)
+        if message is MISSING:
+            message = await self.fetches.run(
+                ("message", message_id), lambda: self._fetch_message(channel_id, message_id)
+            )
+        return message
 
     @staticmethod
     def find_extensions(package: ModuleType) -> set:
@@ -138,5 +339,18 @@ class Menel(commands.AutoShardedBot):
     async def close(self):
         log.info("Stopping the bot")
         await super().close()
-        await self.client.aclose()
-        self.db.client.close()
+        await self.http_clients.aclose()
+        await self.responses.save()
+        if self._browser_start is not None:
+            self._browser_start.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._browser_start
+        await self.browser_pool.close()
+        self.process_pool.close()
+        if self._metrics_runner is not None:
+            await self._metrics_runner.cleanup()
+        try:
+            await self.db.flush_name_history()
+        except pymongo.errors.PyMongoError as e:
+            log.warning(f"Couldn't write name history: {e}")
+        self.db.close()
@@ -7,6 +7,8 @@ from discord.ext import commands
 from ..bot import Menel
 from ..utils.context import Context
 from ..utils.logs import LOGPATH
+from ..utils.markdown import codeblock
+from ..utils.text_tools import human_size, limit_length
 
 
 class BotManagement(commands.Cog, name="Bot Management", command_attrs={"hidden": True}):
@@ -58,6 +60,69 @@ class BotManagement(commands.Cog, name="Bot Management", command_attrs={"hidden"
         await ctx.db.remove_blacklist(*(user.id for user in users))
         await ctx.ok_hand()
 
+    @commands.command()
+    async def cache(self, ctx: Context):
+        """Pokazuje statystyki cache bazy danych i odpowiedzi API"""
+        lines = []
+        for name, collection_cache in ctx.db.caches().items():
+            cache = collection_cache.cache
+            stats = cache.stats
+            lines.append(
+                f"{name}: {len(cache)}/{cache.max_size} ({human_size(cache.bytes)}) "
+                f"hit {stats.hits} miss {stats.misses} ({stats.hit_rate:.1%}) "
+                f"evicted {stats.evictions} expired {stats.expirations} "
+                f"coalesced {collection_cache.lookups.saved}"
+            )
+
+        cache = ctx.bot.responses.cache
+        stats = cache.stats
+        lines.append(
+            f"responses: {len(cache)}/{cache.max_size} ({human_size(cache.bytes)}/{human_size(cache.max_bytes)}) "
+            f"hit {stats.hits} miss {stats.misses} ({stats.hit_rate:.1%}) "
+            f"evicted {stats.evictions} expired {stats.expirations} "
+            f"coalesced {ctx.bot.responses.lookups.saved}"
+        )
+        message_cache = ctx.bot.message_cache
+        lines.append(
+            f"messages: {len(message_cache)}/{message_cache.max_messages} in {message_cache.guilds} servers "
+            f"evicted {message_cache.evictions}"
+        )
+        for source in sorted({source for source, _ in message_cache.lookups}):
+            lookups = message_cache.lookups
+            lines.append(
+                f"  {source}: hit {lookups[source, 'hit']} miss {lookups[source, 'miss']} "
+                f"({message_cache.hit_rate(source):.1%})"
+            )
+        uploads = ctx.bot.uploads
+        lines.append(f"uploads: {len(uploads.cache)}/{uploads.cache.max_size} reused {uploads.reused}")
+        await ctx.embed(codeblock("\n".join(lines)))
+
+    @commands.command()
+    async def messages(self, ctx: Context):
+        """Pokazuje na jakim etapie odrzucane są wiadomości"""
+        stats = self.bot.message_stats
+        total = sum(stats.values())
+        lines = [f"{reason}: {count} ({count / total:.1%})" for reason, count in stats.most_common()]
+        await ctx.embed(codeblock("\n".join(lines) or "Brak wiadomości"))
+
+    @commands.command()
+    async def stats(self, ctx: Context):
+        """Pokazuje czasy wykonywania komend"""
+        commands_metrics = sorted(self.bot.metrics.commands.items(), key=lambda i: i[1].latency.count, reverse=True)
+        if not commands_metrics:
+            await ctx.error("Nie wykonano jeszcze żadnej komendy")
+            return
+
+        lines = [f"{'komenda':<20} {'ilość':>6} {'p50':>7} {'p95':>7} {'p99':>7} {'błędy':>6} {'max':>4}"]
+        for name, metrics in commands_metrics:
+            p50, p95, p99 = (metrics.latency.quantile(q) * 1000 for q in (0.5, 0.95, 0.99))
+            lines.append(
+                f"{limit_length(name, max_length=20):<20} {metrics.latency.count:>6} "
+                f"{p50:>5.0f}ms {p95:>5.0f}ms {p99:>5.0f}ms {metrics.errors:>6} {metrics.max_running:>4}"
+            )
+        lines.append(f"\nzadania w procesach: {self.bot.process_pool.jobs}/{self.bot.process_pool.max_jobs}")
+        await ctx.embed(codeblock(limit_length("\n".join(lines), max_length=4000)))
+
     @commands.Cog.listener()
     async def on_raw_reaction_add(self, payload: discord.RawReactionActionEvent):
         if "\N{WASTEBASKET}" in payload.emoji.name and await self.bot.is_owner(discord.Object(payload.user_id)):
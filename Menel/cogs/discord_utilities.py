@@ -2,7 +2,6 @@ import asyncio
 import io
 import json
 import math
-import zipfile
 from collections import Counter
 from typing import Union
 
@@ -14,6 +13,9 @@ from ..utils import embeds, markdown
 from ..utils.context import Context
 from ..utils.misc import Timer
 from ..utils.text_tools import escape, user_input
+from ..utils.zipping import ZipBuilder
+
+ZIP_DOWNLOADS = 8
 
 
 def oauth2_link(client_id: int, permissions: int) -> str:
@@ -22,6 +24,18 @@ def oauth2_link(client_id: int, permissions: int) -> str:
     )
 
 
+def emoji_filenames(emojis: list[discord.Emoji]) -> list[str]:
+    names = []
+    name_counter = Counter()
+    for emoji in emojis:
+        count = name_counter[(emoji.name, emoji.animated)]
+        name = f"{emoji.name}_{count + 1}" if count > 0 else emoji.name
+        name += ".gif" if emoji.animated else ".png"
+        name_counter[(emoji.name, emoji.animated)] += 1
+        names.append(name)
+    return names
+
+
 async def send_json(ctx: Context, data: dict, filename_id: str) -> None:
     text = json.dumps(data, ensure_ascii=False, indent=2)
     if len(text) <= 4000:
@@ -78,17 +92,16 @@ class DiscordUtilities(commands.Cog, name="Discord Utilities"):
             await ctx.error("Numer strony musi być dodatni")
             return
 
-        names = await ctx.db.get_name_history(user.id)
-        if not names:
+        names, count = await ctx.db.get_name_history(user.id, skip=(page - 1) * 16, limit=16)
+        if not count:
             await ctx.error("Nie znam historii nazw tego użytkownika")
             return
 
-        pages = math.ceil(len(names) / 16)
+        pages = math.ceil(count / 16)
         if page > pages:
             await ctx.error(f"Maksymalny numer strony to {pages}")
             return
 
-        names = names[::-1][(page - 1) * 16 : page * 16]
         embed = embeds.with_author(user, description="\n".join(escape(name) for name in names))
         embed.set_footer(text=f"Strona {page} z {pages}")
         await ctx.send(embed=embed)
@@ -149,24 +162,24 @@ class DiscordUtilities(commands.Cog, name="Discord Utilities"):
             await ctx.error("Na tym serwerze nie ma żadnych emoji")
             return
 
-        async with ctx.channel.typing():
-            with Timer() as download_timer:
-                emoji_data = await asyncio.gather(*(e.read() for e in emojis))
-            file = io.BytesIO()
-            name_counter = Counter()
-            with Timer() as zip_timer:
-                with zipfile.ZipFile(file, "w") as zip_file:
-                    for emoji, data in zip(emojis, emoji_data):
-                        count = name_counter[(emoji.name, emoji.animated)]
-                        name = f"{emoji.name}_{count + 1}" if count > 0 else emoji.name
-                        name += ".gif" if emoji.animated else ".png"
-                        name_counter[(emoji.name, emoji.animated)] += 1
-                        zip_file.writestr(name, data)
-            file.seek(0)
-        await ctx.send(
-            f"Pobrano w {download_timer.time * 1000:.0f} ms, spakowano w {zip_timer.time * 1000:.0f} ms",
-            file=discord.File(file, f"emojis_{ctx.guild.id}.zip"),
-        )
+        names = emoji_filenames(emojis)
+        semaphore = asyncio.Semaphore(ZIP_DOWNLOADS)
+
+        async with ctx.channel.typing(), ZipBuilder(dir=ctx.bot.temp_files.path) as builder:
+
+            async def add(emoji: discord.Emoji, name: str) -> None:
+                async with semaphore:
+                    data = await emoji.read()
+                    await builder.write(name, data)
+
+            with Timer() as timer:
+                await asyncio.gather(*(add(emoji, name) for emoji, name in zip(emojis, names)))
+                file = await builder.finish()
+
+            await ctx.send(
+                f"Spakowano {len(emojis)} emoji w {timer.time * 1000:.0f} ms",
+                file=discord.File(file, f"emojis_{ctx.guild.id}.zip"),
+            )
 
     @commands.group(aliases=["json"], invoke_without_command=True)
     async def raw(self, ctx: Context):
@@ -245,7 +258,7 @@ class DiscordUtilities(commands.Cog, name="Discord Utilities"):
     @commands.Cog.listener()
     async def on_user_update(self, before: discord.User, after: discord.User):
         if (before.name, before.discriminator) != (after.name, after.discriminator):
-            await self.bot.db.add_name_history(after.id, str(before))
+            self.bot.db.add_name_history(after.id, str(before))
 
 
 def setup(bot: Menel):
@@ -1,89 +1,24 @@
-import asyncio
 import imghdr
-import re
-import textwrap
 from io import BytesIO
-from math import sqrt
 from os import environ
 from time import perf_counter
 from typing import Literal, Optional
 
 import discord
-import httpx
 from discord.ext import commands
-from PIL import Image, ImageDraw, ImageFont
+from PIL import Image
 
-from .. import PATH
 from ..bot import Menel
-from ..utils import imperial
 from ..utils.checks import has_attachments
 from ..utils.context import Context
-
-ASCII_IMG_SIZE = 128
-ASCII_STYLES = {
-    "blocks": "█▓▒░ ",
-    "standard": "$@B%8&WM#*oahkbdpqwmZO0QLCJUYXzcvunxrjft/\\|()1{}[]?-_+~<>i!lI;:,\"^`'. ",
-    "minimal": "@%+*:=-. ",
-}
-
-ONEPAGER_MAX_TEXT_LENGTH = 512 * 1024
-ONEPAGER_MARGIN = 64
-ONEPAGER_FONT = ImageFont.truetype(str(PATH / "resources" / "Roboto-Light.ttf"), size=20)
-
-
-def image_to_ascii(image: Image, charset: str, invert: bool) -> str:
-    if image.width >= image.height:
-        size = ASCII_IMG_SIZE, round((image.height / image.width) * (ASCII_IMG_SIZE // 2))
-    else:
-        size = round((image.width / image.height) * (ASCII_IMG_SIZE * 2)), ASCII_IMG_SIZE
-
-    image = image.resize(size, Image.LANCZOS)
-
-    if image.mode != "L":
-        if not invert:
-            white = Image.new("RGB", image.size, color=0xFFFFFF)
-            white.paste(image, mask=image)
-
-        image = image.convert("L", dither=Image.NONE)
-
-    if invert:
-        charset = charset[::-1]
-
-    ascii_image = ""
-    imagedata = list(image.getdata())
-    for i in range(0, image.width * image.height - 1, image.width):
-        row = (charset[round(pixel / 255 * (len(charset) - 1))] for pixel in imagedata[i : i + image.width])
-        ascii_image += "".join(row).rstrip() + "\n"
-
-    return ascii_image
-
-
-def prepare_text(text: str) -> str:
-    text = re.sub(r"\s+", " ", text.strip())
-    return "\n".join(
-        textwrap.wrap(
-            text,
-            width=round(sqrt(len(text)) * 1.25),
-            expand_tabs=False,
-            replace_whitespace=True,
-            drop_whitespace=True,
-            break_on_hyphens=False,
-        )
-    )
-
-
-def render_page(text: str) -> BytesIO:
-    size = ONEPAGER_FONT.getsize_multiline(text)
-    image = Image.new("L", (size[0] + 2 * ONEPAGER_MARGIN, size[1] + 2 * ONEPAGER_MARGIN), 0xFFFFFF)
-
-    draw = ImageDraw.Draw(image)
-    draw.multiline_text((ONEPAGER_MARGIN, ONEPAGER_MARGIN), text, fill=0, font=ONEPAGER_FONT, align="center")
-
-    file = BytesIO()
-    image.save(file, format="png", optimize=True)
-    file.seek(0)
-
-    return file
+from ..utils.rendering import (
+    ASCII_IMG_SIZES,
+    ASCII_STYLES,
+    ONEPAGER_MAX_TEXT_LENGTH,
+    ascii_art,
+    prepare_text,
+    render_page,
+)
 
 
 class Images(commands.Cog):
@@ -96,26 +31,34 @@ class Images(commands.Cog):
         self,
         ctx: Context,
         style: Optional[Literal["blocks", "standard", "minimal"]] = "blocks",
+        size: Optional[Literal["normal", "large"]] = "normal",
         invert: Literal["invert", "inv", "inverted"] = False,
     ):
         """
         Generuje ASCII art z załączonego zdjęcia
         `style`: zestaw znaków
+        `size`: szerokość obrazu w znakach
         `invert`: zamiana ciemnych znaków z jasnymi
         """
         try:
-            image = Image.open(BytesIO(await ctx.message.attachments[0].read()))
+            data = await ctx.message.attachments[0].read()
         except discord.HTTPException:
             await ctx.error("Nie udało się pobrać załączonego pliku")
             return
 
+        # only reads the header
+        image = Image.open(BytesIO(data))
         if image.width < 64 or image.height < 64:
             await ctx.error("Ten obraz jest za mały")
             return
 
-        image = await asyncio.to_thread(image_to_ascii, image, ASCII_STYLES[style], invert is not None)
-        document = await imperial.create_document(image, short_urls=True, expiration=14)
-        await ctx.send(document.raw_link)
+        image = await ctx.bot.process_pool.run(
+            ascii_art, data, ASCII_STYLES[style], invert is not None, ASCII_IMG_SIZES[size]
+        )
+        link = await ctx.bot.uploads.imperial_document(
+            ctx.bot.http_clients["imperial"], image, short_urls=True, expiration=14
+        )
+        await ctx.send(link)
 
     @commands.command(aliases=["burning"])
     async def cooltext(self, ctx: Context, *, text: str):
@@ -136,8 +79,7 @@ class Images(commands.Cog):
                 },
             )
 
-            async with httpx.AsyncClient(verify=False) as client:
-                r = await client.get(r.json()["renderLocation"])
+            r = await ctx.bot.http_clients["cooltext"].get(r.json()["renderLocation"])
 
         await ctx.send(file=discord.File(BytesIO(r.read()), "burning.gif"))
 
@@ -177,11 +119,11 @@ class Images(commands.Cog):
 
         async with ctx.channel.typing():
             start = perf_counter()
-            image = await asyncio.to_thread(render_page, text)
+            image = await ctx.bot.process_pool.run(render_page, text)
             end = perf_counter()
             await ctx.send(
                 f"Wyrenderowano w czasie {round(end - start, 1)}s",
-                file=discord.File(image, attachment.filename.rsplit(".", 1)[0] + ".png"),
+                file=discord.File(BytesIO(image), attachment.filename.rsplit(".", 1)[0] + ".png"),
             )
 
     @commands.command(aliases=["this-person-does-not-exist", "thispersondoesnotexist", "person"])
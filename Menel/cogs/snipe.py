@@ -1,22 +1,141 @@
+import copy
 import datetime
+from collections import OrderedDict, deque
+from typing import Optional
 
 import discord
-from discord.ext import commands
+from discord.ext import commands, tasks
 
 from ..bot import Menel
-from ..utils import embeds
+from ..resources.filesizes import MiB
+from ..utils.cache import sizeof
 from ..utils.context import Context
 from ..utils.text_tools import escape, human_size, plural
 
-
-class SnipeMessage:
-    def __init__(self, text: str, author: discord.Member, time: datetime):
-        self.text = text
-        self.author = author
-        self.time = time
-
-
-_SNIPES_TYPE = dict[int, discord.Message]
+MAX_AGE = datetime.timedelta(hours=2)
+HISTORY_LENGTH = 10
+
+
+# only what create_snipe_embed needs, so the message, its author and attachments can be garbage collected
+class SnipedMessage:
+    __slots__ = ("id", "content", "time", "author", "avatar", "color", "bot", "reference", "attachments", "size")
+
+    def __init__(self, message: discord.Message):
+        self.id: int = message.id
+        self.content: str = message.content
+        self.time: datetime.datetime = message.edited_at or message.created_at
+        self.author = str(message.author)
+        self.avatar: str = message.author.display_avatar.url
+        self.color: int = message.author.color.value
+        self.bot: bool = message.author.bot
+        self.reference: Optional[str] = message.reference.jump_url if message.reference else None
+        # (filename, url, size)
+        self.attachments: tuple[tuple[str, str, int], ...] = tuple(
+            (a.filename, a.url, a.size) for a in message.attachments
+        )
+        self.size = self._size()
+
+    def _size(self) -> int:
+        # the object itself and the smaller fields are roughly 256 bytes
+        return sizeof(self.content) + sizeof(self.author) + sizeof(self.attachments) + 256
+
+    # applies the partial message data of a raw edit event
+    def edited(self, data: dict) -> "SnipedMessage":
+        message = copy.copy(self)
+        if "content" in data:
+            message.content = data["content"]
+        if "attachments" in data:
+            message.attachments = tuple((a["filename"], a["url"], a["size"]) for a in data["attachments"])
+        if edited_at := discord.utils.parse_time(data.get("edited_timestamp")):
+            message.time = edited_at
+        message.size = message._size()
+        return message
+
+    def expired(self, now: datetime.datetime) -> bool:
+        return now - self.time > MAX_AGE
+
+
+class SnipeStore:
+    def __init__(self, *, history_length: int = HISTORY_LENGTH, max_bytes: int = 16 * MiB):
+        self.history_length = history_length
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        # (channel id, kind) -> newest messages, least recently changed histories first
+        self._histories: OrderedDict[tuple[int, str], deque[SnipedMessage]] = OrderedDict()
+
+    def __len__(self) -> int:
+        return sum(len(history) for history in self._histories.values())
+
+    def add(self, channel_id: int, kind: str, message: SnipedMessage) -> None:
+        key = channel_id, kind
+        history = self._histories.get(key)
+        if history is None:
+            history = self._histories[key] = deque(maxlen=self.history_length)
+        elif len(history) == history.maxlen:
+            self.bytes -= history[0].size
+
+        history.append(message)
+        self.bytes += message.size
+        self._histories.move_to_end(key)
+
+        while self.bytes > self.max_bytes and self._histories:
+            self._pop_oldest(next(iter(self._histories)))
+
+    # 1 is the newest message
+    def get(self, channel_id: int, kind: str, index: int, now: datetime.datetime) -> Optional[SnipedMessage]:
+        history = self._histories.get((channel_id, kind))
+        if history is None or not 1 <= index <= len(history):
+            return None
+
+        message = history[-index]
+        return message if not message.expired(now) else None
+
+    def _pop_oldest(self, key: tuple[int, str]) -> None:
+        history = self._histories[key]
+        self.bytes -= history.popleft().size
+        if not history:
+            del self._histories[key]
+
+    def sweep(self, now: datetime.datetime) -> int:
+        removed = 0
+        for key in list(self._histories):
+            history = self._histories[key]
+            while history and history[0].expired(now):
+                self._pop_oldest(key)
+                removed += 1
+        return removed
+
+
+# snapshots of recent messages, so that snipes don't depend on the message cache of discord.py
+class MessageIndex:
+    def __init__(self, *, max_bytes: int = 32 * MiB):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        # message id -> snapshot, oldest messages first
+        self._messages: OrderedDict[int, SnipedMessage] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._messages)
+
+    def add(self, message: SnipedMessage) -> None:
+        self.pop(message.id)
+        self._messages[message.id] = message
+        self.bytes += message.size
+        while self.bytes > self.max_bytes:
+            self.bytes -= self._messages.popitem(last=False)[1].size
+
+    def pop(self, message_id: int) -> Optional[SnipedMessage]:
+        message = self._messages.pop(message_id, None)
+        if message is not None:
+            self.bytes -= message.size
+        return message
+
+    # snipes only show messages from the last MAX_AGE, so older ones aren't needed
+    def sweep(self, now: datetime.datetime) -> int:
+        expired = [i for i, message in self._messages.items() if message.expired(now)]
+        for message_id in expired:
+            self.pop(message_id)
+        return len(expired)
 
 
 class SnipeNotFound(commands.CommandError):
@@ -24,11 +143,14 @@ class SnipeNotFound(commands.CommandError):
 
 
 class Snipe(commands.Cog):
-    def __init__(self):
-        self.delete_snipes: _SNIPES_TYPE = {}
-        self.edit_snipes: _SNIPES_TYPE = {}
-        self.bot_delete_snipes: _SNIPES_TYPE = {}
-        self.bot_edit_snipes: _SNIPES_TYPE = {}
+    def __init__(self, bot: Menel):
+        self.bot = bot
+        self.snipes = SnipeStore()
+        self.messages = MessageIndex()
+        self.sweep_loop.start()
+
+    def cog_unload(self):
+        self.sweep_loop.cancel()
 
     def cog_check(self, ctx):
         if not ctx.guild:
@@ -39,83 +161,114 @@ class Snipe(commands.Cog):
         if isinstance(error, SnipeNotFound):
             await ctx.error("Nie ma")
 
-    @staticmethod
-    def create_snipe_embed(ctx: Context, snipes: _SNIPES_TYPE) -> discord.Embed:
-        if ctx.channel.id not in snipes:
-            raise SnipeNotFound()
-
-        message = snipes[ctx.channel.id]
-        time = message.edited_at or message.created_at
-        color = message.author.color
+    @tasks.loop(minutes=5)
+    async def sweep_loop(self):
+        now = discord.utils.utcnow()
+        self.snipes.sweep(now)
+        self.messages.sweep(now)
 
-        if ctx.command_time - time > datetime.timedelta(hours=2):
+    def create_snipe_embed(self, ctx: Context, kind: str, index: int) -> discord.Embed:
+        message = self.snipes.get(ctx.channel.id, kind, index, ctx.command_time)
+        if message is None:
             raise SnipeNotFound()
 
-        embed = embeds.with_author(
-            message.author,
-            description=message.content,
-            color=color if color != discord.Color.default() else discord.Color.green(),
-            timestamp=time,
+        embed = discord.Embed(
+            description=message.content, color=message.color or discord.Color.green(), timestamp=message.time
         )
+        embed.set_author(name=message.author, icon_url=message.avatar)
         embed.set_footer(text=str(message.id))
 
         if message.reference:
-            embed.add_field(name="Odpowiedź na", value=f"[link]({message.reference.jump_url})", inline=False)
+            embed.add_field(name="Odpowiedź na", value=f"[link]({message.reference})", inline=False)
 
         if message.attachments:
             attachment_count = len(message.attachments)
             embed.add_field(
                 name=f"{plural(attachment_count, 'plik', 'pliki', 'plików')}",
-                value="\n".join(f"[{escape(a.filename)}]({a.url}) {human_size(a.size)}" for a in message.attachments),
+                value="\n".join(
+                    f"[{escape(filename)}]({url}) {human_size(size)}" for filename, url, size in message.attachments
+                ),
                 inline=False,
             )
 
         return embed
 
     @commands.command()
-    async def snipe(self, ctx: Context):
-        """Pokazuje ostatnią usuniętą wiadomość"""
-        await ctx.send(embed=self.create_snipe_embed(ctx, self.delete_snipes))
+    async def snipe(self, ctx: Context, index: int = 1):
+        """
+        Pokazuje ostatnią usuniętą wiadomość
+        `index`: numer wiadomości od najnowszej
+        """
+        await ctx.send(embed=self.create_snipe_embed(ctx, "delete", index))
 
     @commands.command("edit-snipe", aliases=["editsnipe"])
-    async def edit_snipe(self, ctx: Context):
-        """Pokazuje ostatnią edytowaną wiadomość"""
-        await ctx.send(embed=self.create_snipe_embed(ctx, self.edit_snipes))
+    async def edit_snipe(self, ctx: Context, index: int = 1):
+        """
+        Pokazuje ostatnią edytowaną wiadomość
+        `index`: numer wiadomości od najnowszej
+        """
+        await ctx.send(embed=self.create_snipe_embed(ctx, "edit", index))
 
     @commands.command("bot-snipe", aliases=["botsnipe"])
-    async def _bot_snipe(self, ctx: Context):
-        """Pokazuje ostatnią usuniętą wiadomość bota lub webhooka"""
-        await ctx.send(embed=self.create_snipe_embed(ctx, self.bot_delete_snipes))
+    async def _bot_snipe(self, ctx: Context, index: int = 1):
+        """
+        Pokazuje ostatnią usuniętą wiadomość bota lub webhooka
+        `index`: numer wiadomości od najnowszej
+        """
+        await ctx.send(embed=self.create_snipe_embed(ctx, "bot_delete", index))
 
     @commands.command("bot-edit-snipe", aliases=["boteditsnipe"])
-    async def _bot_edit_snipe(self, ctx: Context):
-        """Pokazuje ostatnią edytowaną wiadomość bota lub webhooka"""
-        await ctx.send(embed=self.create_snipe_embed(ctx, self.bot_edit_snipes))
+    async def _bot_edit_snipe(self, ctx: Context, index: int = 1):
+        """
+        Pokazuje ostatnią edytowaną wiadomość bota lub webhooka
+        `index`: numer wiadomości od najnowszej
+        """
+        await ctx.send(embed=self.create_snipe_embed(ctx, "bot_edit", index))
 
     @commands.Cog.listener()
-    async def on_message_edit(self, before: discord.Message, after: discord.Message):
-        if not after.guild:
+    async def on_message(self, m: discord.Message):
+        if not m.guild or not (m.content or m.attachments):
             return
 
-        if before.content == after.content and len(before.attachments) == len(after.attachments):
+        self.messages.add(SnipedMessage(m))
+
+    @commands.Cog.listener()
+    async def on_raw_message_edit(self, payload: discord.RawMessageUpdateEvent):
+        if payload.guild_id is None:
             return
 
-        snipes = self.edit_snipes if not after.author.bot else self.bot_edit_snipes
+        self.bot.message_cache.record("snipe", payload.cached_message is not None)
+        before = self.messages.pop(payload.message_id)
+        if before is None:
+            if payload.cached_message is None:
+                return
+            before = SnipedMessage(payload.cached_message)
+
+        after = before.edited(payload.data)
+        self.messages.add(after)
+
+        if before.content == after.content and len(before.attachments) == len(after.attachments):
+            return
 
-        snipes[after.channel.id] = before
+        self.snipes.add(payload.channel_id, "edit" if not before.bot else "bot_edit", before)
 
     @commands.Cog.listener()
-    async def on_message_delete(self, message: discord.Message):
-        if not message.guild:
+    async def on_raw_message_delete(self, payload: discord.RawMessageDeleteEvent):
+        if payload.guild_id is None:
             return
 
+        self.bot.message_cache.record("snipe", payload.cached_message is not None)
+        message = self.messages.pop(payload.message_id)
+        if message is None:
+            if payload.cached_message is None:
+                return
+            message = SnipedMessage(payload.cached_message)
+
         if not (message.content or message.attachments):
             return
 
-        snipes = self.delete_snipes if not message.author.bot else self.bot_delete_snipes
-
-        snipes[message.channel.id] = message
+        self.snipes.add(payload.channel_id, "delete" if not message.bot else "bot_delete", message)
 
 
 def setup(bot: Menel):
-    bot.add_cog(Snipe())
+    bot.add_cog(Snipe(bot))
@@ -1,10 +1,15 @@
+import logging
+
 import discord
+import pymongo.errors
 from discord.ext import commands, tasks
 
 from Menel.utils.text_tools import plural
 
 from ..bot import Menel
 
+log = logging.getLogger(__name__)
+
 
 class Tasks(commands.Cog):
     def __init__(self, bot: Menel):
@@ -15,6 +20,11 @@ class Tasks(commands.Cog):
         self._db_message_count = 0
 
         self.message_count_loop.start()
+        self.name_history_loop.start()
+
+    def cog_unload(self):
+        # stop() lets a running write finish, after_loop then writes the rest
+        self.name_history_loop.stop()
 
     @tasks.loop(minutes=2)
     async def status_loop(self):
@@ -57,6 +67,21 @@ class Tasks(commands.Cog):
         if self._message_count > 0:
             await self.bot.db.increase_message_count(self._message_count)
 
+    @tasks.loop(seconds=5)
+    async def name_history_loop(self):
+        try:
+            await self.bot.db.flush_name_history()
+        except pymongo.errors.PyMongoError as e:
+            log.warning(f"Couldn't write name history: {e}")
+
+    @name_history_loop.after_loop
+    async def after_name_history_loop(self):
+        # Menel.close() writes the remaining names before the database is closed, this covers reloading the cog
+        try:
+            await self.bot.db.flush_name_history()
+        except pymongo.errors.PyMongoError as e:
+            log.warning(f"Couldn't write name history: {e}")
+
     @commands.Cog.listener()
     async def on_message(self, _):
         self._message_count += 1
@@ -1,4 +1,5 @@
 import asyncio
+import contextlib
 import http.client
 import os
 import re
@@ -6,42 +7,51 @@ import unicodedata
 from io import BytesIO
 from math import floor
 from pathlib import Path
+from time import perf_counter
 from typing import Literal, Optional
 from urllib import parse
 
-import aiohttp
 import dateutil.parser
 import discord
 import httpx
-import pyppeteer
 import pyppeteer.errors
 import unidecode
 import youtube_dl
 from discord.ext import commands
 from jishaku.codeblocks import codeblock_converter
 
-from .. import PATH
 from ..bot import Menel
 from ..resources import filesizes
 from ..resources.languages import LANGUAGES
 from ..utils import embeds, imgur, markdown
+from ..utils.cache import LRUCache
 from ..utils.checks import has_attachments
 from ..utils.context import Context
 from ..utils.converters import URL, LanguageConverter
-from ..utils.errors import SendError
-from ..utils.misc import get_image_url_from_message_or_reply
+from ..utils.errors import ImgurUploadError, RateLimited, SendError
+from ..utils.misc import clamp, get_image_url_from_message_or_reply
+from ..utils.response_cache import normalize
+from ..utils.temp_files import TempFiles
 from ..utils.text_tools import escape, escape_str, limit_length, plural
 
 AUTO = "auto"
+MIN_PROGRESS_INTERVAL = 1.5
+MAX_PROGRESS_INTERVAL = 10
+IMGUR_CONCURRENCY = 4
+# only lookups which miss the response cache count towards it
+DOCS_RATE_LIMIT = commands.CooldownMapping.from_cooldown(3, 5, commands.BucketType.default)
 
 
 class YouTubeDownloader:
-    def __init__(self, *, only_audio: bool = False):
+    def __init__(self, temp_files: TempFiles, *, only_audio: bool = False):
         self.status = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._events: asyncio.Queue[Optional[dict]] = asyncio.Queue()
+        self._finished = asyncio.Event()
 
         self.OPTIONS = {
             "format": "best",
-            "outtmpl": str(PATH / "temp" / (os.urandom(16).hex() + ".%(ext)s")),
+            "outtmpl": temp_files.template(".%(ext)s"),
             "merge_output_format": "mp4",
             "default_search": "auto",
             "progress_hooks": [self._hook],
@@ -65,36 +75,61 @@ class YouTubeDownloader:
 
     async def download(self, video: str) -> None:
         self.status.clear()
-        await asyncio.to_thread(self.ydl.extract_info, video)
+        self._loop = asyncio.get_running_loop()
+        try:
+            await asyncio.to_thread(self.ydl.extract_info, video)
+        finally:
+            self._events.put_nowait(None)
+            self._finished.set()
 
     async def extract_info(self, video: str) -> dict:
         return await asyncio.to_thread(self.ydl.extract_info, video, download=False)
 
+    # called by youtube-dl from the download thread
     def _hook(self, info: dict) -> None:
         self.status = info
+        self._loop.call_soon_threadsafe(self._events.put_nowait, info)
+
+    async def _newest_status(self) -> Optional[dict]:
+        status = await self._events.get()
+        while status is not None and not self._events.empty():
+            status = self._events.get_nowait()
+        return status
 
     async def progress_message(self, m: Context):
         msg = await m.send("Downloading…")
 
-        for _ in range(20):
-            if self.status:
-                break
-
-            await asyncio.sleep(0.5)
+        interval = MIN_PROGRESS_INTERVAL
+        content = None
+        # None means that the download has finished
+        while (status := await self._newest_status()) is not None:
+            total = status.get("total_bytes") or status.get("total_bytes_estimate")
+            if status["status"] != "downloading" or not total:
+                continue
 
-        while self.status and self.status["status"] == "downloading":
-            ratio = self.status["downloaded_bytes"] / self.status["total_bytes"]
+            ratio = status["downloaded_bytes"] / total
             progress = ("\N{FULL BLOCK}" * floor(ratio * 20)).ljust(20, "\N{LIGHT SHADE}")
-            await msg.edit(
-                content=f"{progress} {ratio:.1%} "
-                f"{self.status['_speed_str'].strip()} Pozostało {self.status['_eta_str'].strip()}"
+            new_content = (
+                f"{progress} {ratio:.1%} {status['_speed_str'].strip()} Pozostało {status['_eta_str'].strip()}"
             )
-            await asyncio.sleep(1.5)
+            if new_content != content:
+                content = new_content
+                start = perf_counter()
+                await msg.edit(content=content)
+                # discord.py waits out rate limits inside edit(), so slow edits mean that we should slow down
+                interval = clamp(4 * (perf_counter() - start), MIN_PROGRESS_INTERVAL, MAX_PROGRESS_INTERVAL)
+
+            with contextlib.suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(self._finished.wait(), interval)
 
         await msg.delete()
 
 
 class Utilities(commands.Cog):
+    def __init__(self):
+        # search term -> the term Urban Dictionary redirects it to
+        self.urban_terms = LRUCache(max_size=4096, ttl=24 * 60 * 60)
+
     @commands.command(aliases=["trans", "tr"])
     @commands.cooldown(2, 5, commands.BucketType.user)
     async def translate(
@@ -119,12 +154,13 @@ class Utilities(commands.Cog):
             dest = lang1
 
         if text is None and (ref := ctx.message.reference):
+            ctx.bot.message_cache.record("reference", ref.resolved is not None)
             msg = ref.resolved or await ctx.bot.fetch_message(ref.channel_id, ref.message_id)
             text = msg.content
             if text is None:
                 raise SendError("Podaj tekst do przetłumaczenia lub odpowiedz na wiadomość")
 
-        async with ctx.typing():
+        async def translate() -> Optional[dict]:
             r = await ctx.bot.client.get(
                 "https://translate.googleapis.com/translate_a/single",
                 params={
@@ -137,8 +173,12 @@ class Utilities(commands.Cog):
                 },
             )
             json = r.json()
+            return json if "sentences" in json else None
 
-            if "sentences" not in json:
+        async with ctx.typing():
+            json = await ctx.bot.responses.get("translate", (src, dest, text), translate)
+
+            if json is None:
                 await ctx.error("Tłumacz Google nie zwrócił tłumaczenia")
                 return
 
@@ -156,25 +196,59 @@ class Utilities(commands.Cog):
     @commands.command(aliases=["urban-dictionary", "urban", "ud"])
     async def urbandictionary(self, ctx: Context, *, query: str):
         """Wyszukuje podaną frazę w słowniku Urban Dictionary"""
-        async with ctx.typing():
+
+        async def get_definitions(term: str) -> dict:
+            r = await ctx.client.get("https://api.urbandictionary.com/v0/define", params={"term": term})
+            return r.json()
+
+        async def resolve_term() -> Optional[str]:
             r = await ctx.client.head(
                 "https://www.urbandictionary.com/define.php", params={"term": query}, allow_redirects=False
             )
             if r.status_code == 302:
-                url = httpx.URL(r.headers["Location"])
-                query = url.params["term"]
-            elif r.status_code != 200:
-                await ctx.error("Nie znalazłem tej frazy w Urban Dictionary.")
-                return
+                return httpx.URL(r.headers["Location"]).params["term"]
+            elif r.status_code == 200:
+                return query
+            return None
+
+        async def define() -> Optional[dict]:
+            key = normalize(query, case_sensitive=False)
+            term = self.urban_terms.get(key, None)
+            if term is not None:
+                json = await get_definitions(term)
+            else:
+                # the definitions are requested while the spelling is being checked, usually it doesn't change
+                definitions = asyncio.create_task(get_definitions(query))
+                # an abandoned request which failed would otherwise log "Task exception was never retrieved"
+                definitions.add_done_callback(lambda task: task.cancelled() or task.exception())
+                try:
+                    term = await resolve_term()
+                except BaseException:
+                    definitions.cancel()
+                    raise
+
+                if term is None:
+                    definitions.cancel()
+                    return None
+
+                self.urban_terms.set(key, term)
+                if term == query:
+                    json = await definitions
+                else:
+                    definitions.cancel()
+                    json = await get_definitions(term)
 
-            r = await ctx.client.get("https://api.urbandictionary.com/v0/define", params={"term": query})
-            json = r.json()
+            if "error" in json:
+                raise SendError(f'Urban Dictionary zwróciło błąd:\n{json["error"]}')
 
-        if "error" in json:
-            await ctx.error(f'Urban Dictionary zwróciło błąd:\n{json["error"]}')
-            return
+            return json["list"][0] if json["list"] else None
 
-        data = json["list"][0]
+        async with ctx.typing():
+            data = await ctx.bot.responses.get("urbandictionary", (query,), define)
+
+        if data is None:
+            await ctx.error("Nie znalazłem tej frazy w Urban Dictionary.")
+            return
 
         def remove_brackets(text: str) -> str:
             return re.sub(r"\[(?P<word>.*?)]", r"\g<word>", text, re.DOTALL)
@@ -230,11 +304,11 @@ class Utilities(commands.Cog):
             return
 
         async with ctx.channel.typing():
-            async with aiohttp.request(
-                "POST", "https://emkc.org/api/v1/piston/execute", json={"language": language, "source": code}
-            ) as r:
-                json = await r.json()
-            if r.status != 200:
+            r = await ctx.bot.http_clients["piston"].post(
+                "https://emkc.org/api/v1/piston/execute", json={"language": language, "source": code}
+            )
+            json = r.json()
+            if r.status_code != 200:
                 await ctx.error(json.get("message", "Nieznany błąd."))
                 return
 
@@ -284,11 +358,11 @@ class Utilities(commands.Cog):
     @commands.cooldown(3, 10, commands.BucketType.user)
     async def minecraft(self, ctx: Context, *, player: str):
         """Wysyła skin konta Minecraft Java Edition"""
-        async with ctx.channel.typing():
+
+        async def profile() -> Optional[dict]:
             r = await ctx.client.get(f"https://api.mojang.com/users/profiles/minecraft/{parse.quote(player)}")
             if r.status_code == 204:
-                await ctx.error("Nie znalazłem gracza o tym nicku.")
-                return
+                return None
 
             json = r.json()
             uuid = json["id"]
@@ -301,18 +375,29 @@ class Utilities(commands.Cog):
             ]
 
             responses = await asyncio.gather(*(ctx.client.get(url, params=params) for (url, params) in requests))
-            name_history = responses[0].json()
-            avatar, head, body = (r.read() for r in responses[1:])
+            return {
+                "name": json["name"],
+                "uuid": uuid,
+                "name_history": [name["name"] for name in responses[0].json()],
+                "images": [r.read() for r in responses[1:]],
+            }
+
+        async with ctx.channel.typing():
+            data = await ctx.bot.responses.get("minecraft", (player,), profile)
+            if data is None:
+                await ctx.error("Nie znalazłem gracza o tym nicku.")
+                return
 
-            name_history = ", ".join(escape(name["name"]) for name in name_history)
-            avatar = discord.File(BytesIO(avatar), "avatar.png")
-            head = discord.File(BytesIO(head), "head.png")
-            body = discord.File(BytesIO(body), "body.png")
+            name_history = ", ".join(escape(name) for name in data["name_history"])
+            avatar, head, body = (
+                discord.File(BytesIO(image), filename)
+                for image, filename in zip(data["images"], ("avatar.png", "head.png", "body.png"))
+            )
 
             embed = discord.Embed(
-                description=f"Historia nazw: {name_history}\nUUID: `{uuid}`", color=discord.Color.green()
+                description=f"Historia nazw: {name_history}\nUUID: `{data['uuid']}`", color=discord.Color.green()
             )
-            embed.set_author(name=json["name"], icon_url="attachment://head.png")
+            embed.set_author(name=data["name"], icon_url="attachment://head.png")
             embed.set_thumbnail(url="attachment://avatar.png")
             embed.set_image(url="attachment://body.png")
 
@@ -325,44 +410,41 @@ class Utilities(commands.Cog):
         """Robi i wysyła zrzut ekranu strony internetowej"""
         async with ctx.typing():
             try:
-                browser = await pyppeteer.launch(
-                    ignoreHTTPSErrors=True, headless=True, args=["--no-sandbox", "--disable-dev-shm-usage"]
-                )
+                async with ctx.bot.browser_pool.page() as page:
+                    await page.setViewport(
+                        {"width": 2048, "height": 1024, "deviceScaleFactor": 1 if fullpage is not None else 2}
+                    )
+
+                    try:
+                        await page.goto(url, timeout=30000)
+                    except TimeoutError:
+                        await ctx.error("Minął czas na wczytanie strony.")
+                        return
+                    except (pyppeteer.errors.PageError, pyppeteer.errors.NetworkError):
+                        await ctx.error("Nie udało się wczytać strony. Sprawdź czy podany adres jest poprawny.")
+                        return
+
+                    await asyncio.sleep(2)
+
+                    try:
+                        screenshot: bytes = await page.screenshot(type="png", fullPage=fullpage is not None, encoding="binary")  # type: ignore
+                    except pyppeteer.errors.NetworkError as e:
+                        await ctx.error(str(e))
+                        return
             except http.client.BadStatusLine:
                 await ctx.error("Nie udało się otworzyć przeglądarki. Spróbuj ponownie.")
                 return
 
-            page = await browser.newPage()
-            await page.setViewport(
-                {"width": 2048, "height": 1024, "deviceScaleFactor": 1 if fullpage is not None else 2}
-            )
+            embed = embeds.with_author(ctx.author)
+            image = await ctx.bot.uploads.imgur_image(ctx.bot.http_clients["imgur"], screenshot)
 
-            try:
-                await page.goto(url, timeout=30000)
-            except TimeoutError:
-                await ctx.error("Minął czas na wczytanie strony.")
-            except (pyppeteer.errors.PageError, pyppeteer.errors.NetworkError):
-                await ctx.error("Nie udało się wczytać strony. Sprawdź czy podany adres jest poprawny.")
+            embed.description = f"Zdjęcie strony: {image}"
+            if ctx.channel.nsfw:
+                embed.set_image(url=image)
             else:
-                await asyncio.sleep(2)
+                embed.set_footer(text="Podgląd dostępny jest wyłącznie na kanałach NSFW")
 
-                try:
-                    screenshot: bytes = await page.screenshot(type="png", fullPage=fullpage is not None, encoding="binary")  # type: ignore
-                except pyppeteer.errors.NetworkError as e:
-                    await ctx.error(str(e))
-                else:
-                    embed = embeds.with_author(ctx.author)
-                    image = await imgur.upload_image(screenshot)
-
-                    embed.description = f"Zdjęcie strony: {image}"
-                    if ctx.channel.nsfw:
-                        embed.set_image(url=image)
-                    else:
-                        embed.set_footer(text="Podgląd dostępny jest wyłącznie na kanałach NSFW")
-
-                    await ctx.send(embed=embed)
-            finally:
-                await browser.close()
+            await ctx.send(embed=embed)
 
     @commands.command(aliases=["sauce", "souce", "sn"])
     @commands.is_nsfw()
@@ -415,23 +497,16 @@ class Utilities(commands.Cog):
     @commands.command("unshorten-url", aliases=["unshorten", "unshort"])
     async def unshorten_url(self, ctx: Context, *, url: URL):
         """Pokazuje przekierowania skróconego linku"""
-        urls = []
-        shortened = False
         async with ctx.typing():
-            while True:
-                r = await ctx.client.head(url, allow_redirects=False)
-                urls.append(str(r.url))
-
-                if "Location" not in r.headers:
-                    break
-
-                url = r.headers["Location"]
-                if len(urls) >= 16 or url in urls:
-                    shortened = True
-                    break
+            chain = await ctx.bot.redirects.resolve(url)
 
+        urls = chain.urls
+        shortened = not chain.complete
         if len(urls) <= 1:
-            await ctx.error("Ten link nie jest skrócony")
+            if chain.reason == "timeout":
+                await ctx.error("Minął czas na połączenie z serwerem")
+            else:
+                await ctx.error("Ten link nie jest skrócony")
             return
 
         if not shortened:
@@ -445,26 +520,33 @@ class Utilities(commands.Cog):
 
     @commands.command(aliases=["rtfm"])
     @commands.cooldown(3, 10, commands.BucketType.user)
-    @commands.cooldown(3, 5)  # API rate limit
     async def docs(self, ctx: Context, *, query: str):
         """Przeszukuje dokumentację biblioteki discord.py (gałęzi master)"""
-        r = await ctx.client.get(
-            "https://idevision.net/api/public/rtfm",
-            params={
-                "show-labels": True,
-                "label-labels": False,
-                "location": "https://discordpy.readthedocs.io/en/master/",
-                "query": query,
-            },
-        )
 
-        json = r.json()
-        nodes = json["nodes"]
+        async def search() -> Optional[dict]:
+            bucket = DOCS_RATE_LIMIT.get_bucket(ctx.message)
+            if retry_after := bucket.update_rate_limit():
+                raise RateLimited(retry_after)
 
-        if not nodes:
+            r = await ctx.client.get(
+                "https://idevision.net/api/public/rtfm",
+                params={
+                    "show-labels": True,
+                    "label-labels": False,
+                    "location": "https://discordpy.readthedocs.io/en/master/",
+                    "query": query,
+                },
+            )
+            json = r.json()
+            return json if json["nodes"] else None
+
+        json = await ctx.bot.responses.get("docs", (query,), search)
+
+        if json is None:
             await ctx.error("Nie znaleziono żadnych pasujących wyników")
             return
 
+        nodes = json["nodes"]
         text = [f"[{markdown.code(name)}]({url})" for name, url in nodes.items()]
 
         embed = embeds.with_author(
@@ -486,7 +568,7 @@ class Utilities(commands.Cog):
         `video`: link do strony z filmem
         """
         await ctx.channel.trigger_typing()
-        downloader = YouTubeDownloader(only_audio=audio is not None)
+        downloader = YouTubeDownloader(ctx.bot.temp_files, only_audio=audio is not None)
 
         progress_message = None
         try:
@@ -510,6 +592,10 @@ class Utilities(commands.Cog):
                 await ctx.error("Maksymalny rozmiar filmu to 100 MiB")
                 return
 
+            if not ctx.bot.temp_files.has_space_for(filesize or 200 * filesizes.MiB):
+                await ctx.error("Brak miejsca na dysku. Spróbuj ponownie później")
+                return
+
             progress_message = asyncio.create_task(downloader.progress_message(ctx))
             await downloader.download(info["webpage_url"])
         except youtube_dl.utils.YoutubeDLError as e:
@@ -524,7 +610,7 @@ class Utilities(commands.Cog):
         try:
             async with ctx.channel.typing():
                 with open(path, "rb") as f:
-                    video = await imgur.upload_video(f.read())
+                    video = await imgur.upload_video(ctx.bot.http_clients["imgur"], f)
         finally:
             path.unlink(missing_ok=True)
 
@@ -535,9 +621,33 @@ class Utilities(commands.Cog):
     @commands.cooldown(2, 10, commands.BucketType.user)
     async def _imgur(self, ctx: Context):
         """Przesyła załączone zdjęcia na Imgur"""
+        client = ctx.bot.http_clients["imgur"]
+        semaphore = asyncio.Semaphore(IMGUR_CONCURRENCY)
+
+        # each attachment is downloaded and uploaded on its own, so one failure doesn't abort the rest
+        async def upload(attachment: discord.Attachment) -> str:
+            async with semaphore:
+                try:
+                    image = await ctx.bot.uploads.imgur_image(client, await attachment.read())
+                except ImgurUploadError as e:
+                    error = f"{e.code}: {e.message}"
+                except discord.HTTPException as e:
+                    error = str(e)
+                except httpx.TimeoutException:
+                    error = "Timeout"
+                except httpx.HTTPError as e:
+                    error = str(e) or type(e).__name__
+                except ValueError:
+                    # r.json() of a response which isn't JSON
+                    error = "Nieprawidłowa odpowiedź serwera Imgur"
+                else:
+                    return f"<{image}>"
+
+            return f"{escape(attachment.filename)}: {escape(limit_length(error, max_length=128, max_lines=1))}"
+
         async with ctx.typing():
-            images = [await imgur.upload_image(await a.read()) for a in ctx.message.attachments]
-            await ctx.send("\n".join(f"<{image}>" for image in images))
+            lines = await asyncio.gather(*(upload(a) for a in ctx.message.attachments))
+            await ctx.send("\n".join(lines))
 
 
 def setup(bot: Menel):
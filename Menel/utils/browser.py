@@ -0,0 +1,129 @@
+import asyncio
+import contextlib
+import logging
+from collections import Counter
+from typing import AsyncIterator, Optional
+
+import pyppeteer
+from pyppeteer.browser import Browser
+from pyppeteer.page import Page
+
+from ..resources.filesizes import KiB, MiB
+
+log = logging.getLogger(__name__)
+
+
+def process_tree_memory(pid: int) -> int:
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            rss = next((int(line.split()[1]) * KiB for line in f if line.startswith("VmRSS:")), 0)
+    except OSError:
+        return 0
+
+    # the children file needs a kernel built with CONFIG_PROC_CHILDREN, without it only the process itself counts
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children") as f:
+            children = f.read().split()
+    except OSError:
+        children = []
+
+    return rss + sum(process_tree_memory(int(child)) for child in children)
+
+
+class BrowserPool:
+    def __init__(self, *, max_pages: int = 64, max_memory: int = 768 * MiB) -> None:
+        self.max_pages = max_pages
+        self.max_memory = max_memory
+        self.launch_options = {
+            "ignoreHTTPSErrors": True,
+            "headless": True,
+            "args": ["--no-sandbox", "--disable-dev-shm-usage"],
+            "handleSIGINT": False,
+            "handleSIGTERM": False,
+            "handleSIGHUP": False,
+        }
+
+        self._browser: Optional[Browser] = None
+        self._pages = 0  # pages opened by the current browser
+        self._active: Counter[Browser] = Counter()
+        # launching Chromium takes seconds, so pages wait for a shared launch instead of a lock
+        self._launching: Optional[asyncio.Task] = None
+
+    def _should_recycle(self, browser: Browser) -> bool:
+        if browser.process is not None and browser.process.poll() is not None:
+            return True
+        if self._pages >= self.max_pages:
+            return True
+        return browser.process is not None and process_tree_memory(browser.process.pid) > self.max_memory
+
+    def _launch(self) -> asyncio.Task:
+        if self._launching is None:
+            self._launching = asyncio.create_task(self._replace(self._browser))
+            # the waiters might all be cancelled
+            self._launching.add_done_callback(lambda task: task.cancelled() or task.exception())
+        return self._launching
+
+    async def _replace(self, old: Optional[Browser]) -> Browser:
+        try:
+            browser = await pyppeteer.launch(**self.launch_options)
+        finally:
+            self._launching = None
+        log.debug("Launched a browser")
+
+        self._browser = browser
+        self._pages = 0
+        if old is not None and not self._active[old]:
+            await self._close(old)
+        return browser
+
+    async def start(self) -> None:
+        if self._browser is not None:
+            return
+        try:
+            # shielded, so that cancelling the start doesn't leave a half launched browser
+            await asyncio.shield(self._launch())
+        except Exception as e:
+            log.warning(f"Couldn't launch a browser: {e!r}")
+
+    async def _acquire(self) -> Browser:
+        while True:
+            browser = self._browser
+            if browser is not None and not self._should_recycle(browser):
+                self._pages += 1
+                self._active[browser] += 1
+                return browser
+            await asyncio.shield(self._launch())
+
+    async def _release(self, browser: Browser) -> None:
+        self._active[browser] -= 1
+        if not self._active[browser]:
+            del self._active[browser]
+            # retired browsers are closed by the last page using them
+            if browser is not self._browser:
+                await self._close(browser)
+
+    @staticmethod
+    async def _close(browser: Browser) -> None:
+        with contextlib.suppress(Exception):
+            await browser.close()
+
+    @contextlib.asynccontextmanager
+    async def page(self) -> AsyncIterator[Page]:
+        browser = await self._acquire()
+        try:
+            context = await browser.createIncognitoBrowserContext()
+            try:
+                yield await context.newPage()
+            finally:
+                with contextlib.suppress(Exception):
+                    await context.close()
+        finally:
+            await self._release(browser)
+
+    async def close(self) -> None:
+        if self._launching is not None:
+            with contextlib.suppress(Exception):
+                await self._launching
+        browsers = {*self._active, self._browser} - {None}
+        self._browser = None
+        await asyncio.gather(*(self._close(browser) for browser in browsers))
@@ -0,0 +1,141 @@
+import asyncio
+import sys
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Hashable, Iterator, Optional
+
+MISSING: Any = object()
+
+
+def sizeof(obj: Any) -> int:
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(sizeof(k) + sizeof(v) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(sizeof(i) for i in obj)
+    return size
+
+
+@dataclass
+class CacheStats:
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+    expirations: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+
+class LRUCache:
+    def __init__(
+        self,
+        *,
+        max_size: int,
+        max_bytes: Optional[int] = None,
+        ttl: Optional[float] = None,
+        negative_ttl: Optional[float] = None,
+    ) -> None:
+        self.max_size = max_size
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.bytes = 0
+        self.stats = CacheStats()
+        # key -> (value, expiration time or None, size in bytes)
+        self._data: OrderedDict[Hashable, tuple[Any, Optional[float], int]] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return self.peek(key) is not MISSING
+
+    def peek(self, key: Hashable, default: Any = MISSING) -> Any:
+        try:
+            value, expires, _ = self._data[key]
+        except KeyError:
+            return default
+
+        if expires is not None and expires <= time.monotonic():
+            self._remove(key)
+            self.stats.expirations += 1
+            return default
+
+        return value
+
+    def get(self, key: Hashable, default: Any = MISSING) -> Any:
+        value = self.peek(key)
+        if value is MISSING:
+            self.stats.misses += 1
+            return default
+
+        self.stats.hits += 1
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key: Hashable, value: Any, *, ttl: Optional[float] = None) -> None:
+        if ttl is None:
+            ttl = self.negative_ttl if value is None and self.negative_ttl is not None else self.ttl
+
+        if key in self._data:
+            self._remove(key)
+
+        size = sizeof(value) if self.max_bytes is not None else 0
+        self._data[key] = value, time.monotonic() + ttl if ttl is not None else None, size
+        self.bytes += size
+        self._evict()
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        if key not in self._data:
+            return default
+        return self._remove(key)
+
+    # (key, value, seconds left until expiration or None) of the entries which haven't expired yet
+    def entries(self) -> Iterator[tuple[Hashable, Any, Optional[float]]]:
+        now = time.monotonic()
+        for key, (value, expires, _) in self._data.items():
+            if expires is None:
+                yield key, value, None
+            elif expires > now:
+                yield key, value, expires - now
+
+    def clear(self) -> None:
+        self._data.clear()
+        self.bytes = 0
+
+    def _remove(self, key: Hashable) -> Any:
+        value, _, size = self._data.pop(key)
+        self.bytes -= size
+        return value
+
+    def _evict(self) -> None:
+        while len(self._data) > self.max_size or (
+            self.max_bytes is not None and self.bytes > self.max_bytes and len(self._data) > 1
+        ):
+            key = next(iter(self._data))
+            self._remove(key)
+            self.stats.evictions += 1
+
+
+class SingleFlight:
+    def __init__(self) -> None:
+        self.saved = 0
+        self._pending: dict[Hashable, asyncio.Task] = {}
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._pending
+
+    async def run(self, key: Hashable, factory: Callable[[], Awaitable[Any]]) -> Any:
+        task = self._pending.get(key)
+        if task is not None:
+            self.saved += 1
+        else:
+            task = self._pending[key] = asyncio.ensure_future(factory())
+            task.add_done_callback(lambda _: self._pending.pop(key, None))
+
+        # shielded so that a cancelled caller doesn't cancel the lookup for everyone else
+        return await asyncio.shield(task)
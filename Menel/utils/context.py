@@ -3,6 +3,7 @@ from __future__ import annotations
 import logging
 import sys
 import traceback
+from time import perf_counter
 from typing import TYPE_CHECKING, Optional, Union
 
 import discord
@@ -27,6 +28,8 @@ class Context(commands.Context):
     bot: Menel
 
     def __init__(self, **kwargs):
+        # the context is created before the message is parsed, so this covers parsing too
+        self.perf_start = perf_counter()
         super().__init__(**kwargs)
         self.db: Database = self.bot.db
         self.client: httpx.AsyncClient = self.bot.client
@@ -1,58 +1,163 @@
-from collections import defaultdict
+import asyncio
+import datetime
+import logging
 from os import environ
-from typing import Any, Hashable, Optional
+from typing import Any, AsyncIterable, Callable, Hashable, Iterable, Optional
 
 import discord
 import motor
 import motor.motor_asyncio
 import pymongo
 import pymongo.collection
+import pymongo.errors
+
+from ..resources.filesizes import MiB
+from .cache import MISSING, LRUCache, SingleFlight
+from .prefixes import PrefixMatcher
+
+log = logging.getLogger(__name__)
+
+DEFAULT_PREFIXES = (".", "?")
+DEFAULT_PREFIX_MATCHER = PrefixMatcher(DEFAULT_PREFIXES)
+# older names are removed from the history
+NAME_HISTORY_LENGTH = 256
+
+
+def prefix_matcher(prefixes: Optional[list[str]]) -> PrefixMatcher:
+    return PrefixMatcher(prefixes) if prefixes is not None else DEFAULT_PREFIX_MATCHER
+
+
+# stands in for a MongoDB change stream, e.g. in tests
+class LocalChangeStream:
+    def __init__(self) -> None:
+        self._queue: asyncio.Queue[dict] = asyncio.Queue()
+
+    def push(self, change: dict) -> None:
+        self._queue.put_nowait(change)
+
+    def __aiter__(self) -> "LocalChangeStream":
+        return self
+
+    async def __anext__(self) -> dict:
+        return await self._queue.get()
 
 
 class CollectionCache:
     _update_kwargs = {"projection": {"_id": False}, "upsert": True, "return_document": pymongo.ReturnDocument.AFTER}
 
-    def __init__(self, collection: Any) -> None:
+    def __init__(
+        self, collection: Any, *, max_size: int, max_bytes: Optional[int] = None, negative_ttl: Optional[float] = None
+    ) -> None:
         self.collection = collection
-        self.cache: defaultdict[Hashable, Optional[dict]] = defaultdict(dict)
+        self.cache = LRUCache(max_size=max_size, max_bytes=max_bytes, negative_ttl=negative_ttl)
+        self.lookups = SingleFlight()
+        # called with the new version of a document whenever it's changed remotely
+        self.listeners: dict[Hashable, Callable[[Optional[dict]], None]] = {}
 
-    async def get(self, document_id: Hashable, key: str) -> Optional[Any]:
+    async def _fetch(self, document_id: Hashable) -> Optional[dict]:
+        document = await self.collection.find_one(document_id, projection={"_id": False})
+        # don't overwrite a document updated while the lookup was in flight
         if document_id not in self.cache:
-            print(document_id, key)
-            document = await self.collection.find_one(document_id)
-            if document is not None:
-                id = document.pop("_id")
-                self.cache[id] = document
-                return document.get(key)
-            else:
-                self.cache[document_id] = None
-                return None
-
-        cache = self.cache[document_id]
-        if cache is not None:
-            return cache.get(key)
+            self.cache.set(document_id, document)
+        return document
+
+    async def _document(self, document_id: Hashable) -> Optional[dict]:
+        document = self.cache.get(document_id)
+        if document is MISSING:
+            document = await self.lookups.run(document_id, lambda: self._fetch(document_id))
+        return document
+
+    async def get(self, document_id: Hashable, key: str) -> Optional[Any]:
+        document = await self._document(document_id)
+        if document is not None:
+            return document.get(key)
         else:
             return None
 
+    async def get_derived(self, document_id: Hashable, key: str, factory: Callable[[Optional[Any]], Any]) -> Any:
+        document = await self._document(document_id)
+        if document is None:
+            return factory(None)
+
+        # kept in the cached document under a non-string key, so it's dropped together with the document
+        derived_key = key, factory
+        if derived_key not in document:
+            document[derived_key] = factory(document.get(key))
+        return document[derived_key]
+
+    async def prefetch(self, document_ids: Iterable[Hashable], *, batch_size: int = 1024) -> None:
+        missing = [i for i in document_ids if i not in self.cache][: self.cache.max_size]
+        for i in range(0, len(missing), batch_size):
+            batch = missing[i : i + batch_size]
+            documents = {}
+            async for document in self.collection.find({"_id": {"$in": batch}}):
+                documents[document.pop("_id")] = document
+
+            for document_id in batch:
+                if document_id not in self.cache:
+                    self.cache.set(document_id, documents.get(document_id))
+
+    def apply_change(self, change: dict) -> None:
+        operation = change["operationType"]
+        if operation in {"drop", "rename", "dropDatabase", "invalidate"}:
+            self.cache.clear()
+            return
+
+        document_id = change["documentKey"]["_id"]
+        document = change.get("fullDocument") if operation != "delete" else None
+        if document is not None:
+            document.pop("_id", None)
+
+        if (listener := self.listeners.get(document_id)) is not None:
+            listener(document)
+
+        # documents which aren't cached will be fetched fresh when needed
+        if document_id not in self.cache and document_id not in self.lookups:
+            return
+
+        if document is not None or operation == "delete":
+            self.cache.set(document_id, document)
+        else:
+            self.cache.pop(document_id)
+
+    async def watch(self, changes: Optional[AsyncIterable[dict]] = None) -> None:
+        if changes is not None:
+            async for change in changes:
+                self.apply_change(change)
+            return
+
+        resume_token = None
+        while True:
+            try:
+                async with self.collection.watch(full_document="updateLookup", resume_after=resume_token) as stream:
+                    async for change in stream:
+                        resume_token = stream.resume_token
+                        self.apply_change(change)
+                        if change["operationType"] == "invalidate":
+                            # a stream can't be resumed after an invalidate event, the cache has been cleared anyway
+                            resume_token = None
+            except pymongo.errors.PyMongoError as e:
+                log.warning(f"Change stream of {self.collection.name} failed: {e}")
+                # changes could have been missed in the meantime
+                self.cache.clear()
+                resume_token = None
+                await asyncio.sleep(10)
+
+    async def _update(self, document_id: Hashable, update: dict) -> None:
+        document = await self.collection.find_one_and_update({"_id": document_id}, update, **self._update_kwargs)
+        self.cache.set(document_id, document)
+
     async def set(self, document_id: Hashable, key: str, value: Any) -> None:
-        self.cache[document_id] = await self.collection.find_one_and_update(
-            {"_id": document_id}, {"$set": {key: value}}, **self._update_kwargs
-        )
+        await self._update(document_id, {"$set": {key: value}})
 
     async def unset(self, document_id: Hashable, key: str) -> None:
-        self.cache[document_id] = await self.collection.find_one_and_update(
-            {"_id": document_id}, {"$unset": {key: None}}, **self._update_kwargs
-        )
+        await self._update(document_id, {"$unset": {key: None}})
 
     async def add_to_set(self, document_id: Hashable, key: str, *values: Any) -> None:
-        self.cache[document_id] = await self.collection.find_one_and_update(
-            {"_id": document_id}, {"$addToSet": {key: {"$each": values}}}, **self._update_kwargs
-        )
+        await self._update(document_id, {"$addToSet": {key: {"$each": values}}})
 
     async def pull(self, document_id: Hashable, key: str, *values: Any) -> None:
-        self.cache[document_id] = await self.collection.find_one_and_update(
-            {"_id": document_id}, {"$pull": {key: {"$in": values}}}, **self._update_kwargs
-        )
+        await self._update(document_id, {"$pull": {key: {"$in": values}}})
 
 
 class Database:
@@ -75,14 +180,52 @@ class Database:
         self.name_history = self._db["name_history"]
         self.bot_config = self._db["bot_config"]
         self.guild_config = self._db["guild_config"]
+        self.uploads = self._db["uploads"]
+
+        self.bot_config_cache = CollectionCache(self.bot_config, max_size=64)
+        self.guild_config_cache = CollectionCache(
+            self.guild_config, max_size=16 * 1024, max_bytes=8 * MiB, negative_ttl=10 * 60
+        )
+        self._watchers: list[asyncio.Task] = []
+
+        # user id -> names which haven't been written yet, oldest first
+        self._name_history_buffer: dict[int, list[str]] = {}
+        # held while names are being written, they aren't in the buffer or the database until it's done
+        self._name_history_lock = asyncio.Lock()
+
+        self.blacklist: frozenset[int] = frozenset()
+        self.bot_config_cache.listeners["blacklist"] = self._on_blacklist_change
 
-        self.bot_config_cache = CollectionCache(self.bot_config)
-        self.guild_config_cache = CollectionCache(self.guild_config)
+    def watch(
+        self, *, bot_config: Optional[AsyncIterable[dict]] = None, guild_config: Optional[AsyncIterable[dict]] = None
+    ) -> None:
+        if self._watchers:
+            return
+
+        # inserts are applied to cached misses, so they don't have to expire anymore
+        self.guild_config_cache.cache.negative_ttl = None
+        self._watchers = [
+            asyncio.create_task(self.bot_config_cache.watch(bot_config)),
+            asyncio.create_task(self.guild_config_cache.watch(guild_config)),
+        ]
+
+    async def create_indexes(self) -> None:
+        # expired uploads are removed by MongoDB
+        await self.uploads.create_index("expires", expireAfterSeconds=0)
+
+    def close(self) -> None:
+        for task in self._watchers:
+            task.cancel()
+        self._watchers.clear()
+        self.client.close()
+
+    def caches(self) -> dict[str, CollectionCache]:
+        return {"bot_config": self.bot_config_cache, "guild_config": self.guild_config_cache}
 
     # prefixes
 
     async def get_prefixes(self, guild: Optional[discord.Guild]) -> list[str]:
-        default = [".", "?"]
+        default = list(DEFAULT_PREFIXES)
         if guild is None:
             return default
         prefixes = await self.guild_config_cache.get(guild.id, "prefixes")
@@ -90,6 +233,14 @@ class Database:
             return prefixes
         return default
 
+    async def get_prefix_matcher(self, guild: Optional[discord.Guild]) -> PrefixMatcher:
+        if guild is None:
+            return DEFAULT_PREFIX_MATCHER
+        return await self.guild_config_cache.get_derived(guild.id, "prefixes", prefix_matcher)
+
+    async def prefetch_guild_configs(self, guild_ids: Iterable[int]) -> None:
+        await self.guild_config_cache.prefetch(guild_ids)
+
     async def set_prefixes(self, guild_id: int, prefixes: list[str]) -> None:
         await self.guild_config_cache.set(guild_id, "prefixes", prefixes)
 
@@ -104,11 +255,22 @@ class Database:
             return users
         return []
 
+    async def load_blacklist(self) -> None:
+        self.blacklist = frozenset(await self.get_blacklist())
+
+    def _on_blacklist_change(self, document: Optional[dict]) -> None:
+        self.blacklist = frozenset(document.get("users", ())) if document is not None else frozenset()
+
+    def is_blacklisted(self, user_id: int) -> bool:
+        return user_id in self.blacklist
+
     async def add_blacklist(self, *user_ids: int) -> None:
         await self.bot_config_cache.add_to_set("blacklist", "users", *user_ids)
+        self.blacklist = self.blacklist.union(user_ids)
 
     async def remove_blacklist(self, *user_ids: int) -> None:
         await self.bot_config_cache.pull("blacklist", "users", *user_ids)
+        self.blacklist = self.blacklist.difference(user_ids)
 
     # message count
 
@@ -128,9 +290,83 @@ class Database:
 
     # name history
 
-    async def get_name_history(self, user_id: int) -> list[str]:
-        document = await self.name_history.find_one(user_id)
-        return document["names"] if document else []
+    # returns a page of the names starting from the newest one and the number of all names
+    async def get_name_history(self, user_id: int, *, skip: int = 0, limit: int = 16) -> tuple[list[str], int]:
+        async with self._name_history_lock:
+            return await self._get_name_history(user_id, skip, limit)
+
+    async def _get_name_history(self, user_id: int, skip: int, limit: int) -> tuple[list[str], int]:
+        pending = self._name_history_buffer.get(user_id, [])[::-1]
+        names = pending[skip : skip + limit]
+        # only the requested part of the array is sent by the database
+        documents = await self.name_history.aggregate(
+            [
+                {"$match": {"_id": user_id}},
+                {
+                    "$project": {
+                        "_id": False,
+                        "count": {"$size": "$names"},
+                        "names": {
+                            "$slice": [
+                                {"$reverseArray": "$names"},
+                                max(skip - len(pending), 0),
+                                max(limit - len(names), 1),
+                            ]
+                        },
+                    }
+                },
+            ]
+        ).to_list(1)
+
+        if not documents:
+            return names, len(pending)
+
+        document = documents[0]
+        if len(names) < limit:
+            names += document["names"]
+        return names, min(document["count"] + len(pending), NAME_HISTORY_LENGTH)
+
+    def add_name_history(self, user_id: int, name: str) -> None:
+        self._name_history_buffer.setdefault(user_id, []).append(name)
+
+    async def flush_name_history(self) -> int:
+        async with self._name_history_lock:
+            return await self._flush_name_history()
+
+    async def _flush_name_history(self) -> int:
+        buffer, self._name_history_buffer = self._name_history_buffer, {}
+        if not buffer:
+            return 0
+
+        requests = [
+            pymongo.UpdateOne(
+                {"_id": user_id}, {"$push": {"names": {"$each": names, "$slice": -NAME_HISTORY_LENGTH}}}, upsert=True
+            )
+            for user_id, names in buffer.items()
+        ]
+        try:
+            await self.name_history.bulk_write(requests, ordered=False)
+        except pymongo.errors.PyMongoError as e:
+            if isinstance(e, pymongo.errors.BulkWriteError):
+                failed = {error["index"] for error in e.details["writeErrors"]}
+                buffer = {user_id: names for i, (user_id, names) in enumerate(buffer.items()) if i in failed}
+
+            # written again with the next batch, newer names go after the ones which failed
+            for user_id, names in self._name_history_buffer.items():
+                buffer.setdefault(user_id, []).extend(names)
+            self._name_history_buffer = buffer
+            raise
+        return len(requests)
+
+    # uploads
+
+    async def get_upload(
+        self, key: str, *, min_lifetime: datetime.timedelta = datetime.timedelta()
+    ) -> Optional[tuple[str, datetime.datetime]]:
+        document = await self.uploads.find_one(
+            {"_id": key, "expires": {"$gt": datetime.datetime.utcnow() + min_lifetime}}, projection={"_id": False}
+        )
+        return (document["url"], document["expires"]) if document else None
 
-    async def add_name_history(self, user_id: int, name: str) -> None:
-        await self.name_history.update_one({"_id": user_id}, {"$push": {"names": name}}, upsert=True)
+    async def add_upload(self, key: str, url: str, expires: datetime.datetime) -> None:
+        await self.uploads.replace_one({"_id": key}, {"url": url, "expires": expires}, upsert=True)
@@ -145,5 +145,14 @@ async def command_error(ctx: Context, error: commands.CommandError) -> None:  #
         elif isinstance(original, errors.ImgurUploadError):
             message = escape(limit_length(original.message, max_length=1024, max_lines=4))
             await ctx.error(f"{original.code}: {message}")
+        elif isinstance(original, errors.RateLimited):
+            await ctx.error(
+                f"Poczekaj jeszcze {plural_time(math.ceil(original.retry_after))}",
+                delete_after=clamp(original.retry_after, 2, 30),
+            )
+        elif isinstance(original, errors.WorkerPoolFull):
+            await ctx.error("Zbyt wiele zadań czeka na wykonanie. Spróbuj ponownie za chwilę")
+        elif isinstance(original, errors.WorkerTimeout):
+            await ctx.error("Minął czas na wykonanie zadania")
         else:
             await ctx.report_exception(original)
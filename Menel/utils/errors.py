@@ -42,7 +42,21 @@ class BadAttachmentType(commands.CheckFailure):
     type: str
 
 
+# raised by commands which share a rate limit of an API, but only when they actually call it
+@dataclass
+class RateLimited(Exception):
+    retry_after: float
+
+
 @dataclass
 class ImgurUploadError(Exception):
     code: int
     message: str
+
+
+class WorkerPoolFull(Exception):
+    pass
+
+
+class WorkerTimeout(Exception):
+    pass
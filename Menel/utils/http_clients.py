@@ -0,0 +1,40 @@
+import asyncio
+
+import httpx
+
+# settings of the connection pool for each upstream host
+UPSTREAMS: dict[str, dict] = {
+    "default": {"timeout": httpx.Timeout(10)},
+    "imgur": {
+        "timeout": httpx.Timeout(60, connect=5),
+        "limits": httpx.Limits(max_connections=8, max_keepalive_connections=4),
+    },
+    "imperial": {
+        "timeout": httpx.Timeout(20, connect=5),
+        "limits": httpx.Limits(max_connections=4, max_keepalive_connections=2),
+    },
+    "cooltext": {
+        "timeout": httpx.Timeout(15, connect=5),
+        "limits": httpx.Limits(max_connections=4, max_keepalive_connections=2),
+        "verify": False,
+    },
+    "piston": {
+        "timeout": httpx.Timeout(20, connect=5),
+        "limits": httpx.Limits(max_connections=4, max_keepalive_connections=2),
+    },
+}
+
+
+class HTTPClients:
+    def __init__(self) -> None:
+        self._clients: dict[str, httpx.AsyncClient] = {}
+
+    def __getitem__(self, upstream: str) -> httpx.AsyncClient:
+        client = self._clients.get(upstream)
+        if client is None or client.is_closed:
+            client = self._clients[upstream] = httpx.AsyncClient(http2=True, **UPSTREAMS[upstream])
+        return client
+
+    async def aclose(self) -> None:
+        await asyncio.gather(*(client.aclose() for client in self._clients.values()))
+        self._clients.clear()
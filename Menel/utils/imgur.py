@@ -1,18 +1,19 @@
 from os import environ
+from typing import BinaryIO, Union
 
 import httpx
 
 from ..utils.errors import ImgurUploadError
 
 
-async def _upload(filename: str, file: bytes) -> str:
-    async with httpx.AsyncClient() as client:
-        r = await client.post(
-            "https://api.imgur.com/3/upload",
-            files={filename: file},
-            headers={"Authorization": f"Client-ID {environ['IMGUR_CLIENT_ID']}"},
-        )
-        json = r.json()
+# file objects are streamed in chunks instead of being read into memory
+async def _upload(client: httpx.AsyncClient, filename: str, file: Union[bytes, BinaryIO]) -> str:
+    r = await client.post(
+        "https://api.imgur.com/3/upload",
+        files={filename: file},
+        headers={"Authorization": f"Client-ID {environ['IMGUR_CLIENT_ID']}"},
+    )
+    json = r.json()
 
     if r.status_code == 200:
         return json["data"]["link"]
@@ -20,9 +21,9 @@ async def _upload(filename: str, file: bytes) -> str:
         raise ImgurUploadError(json.get("status", 0), json["data"].get("error", "Nieznany błąd serwera Imgur"))
 
 
-async def upload_image(image: bytes) -> str:
-    return await _upload("image", image)
+async def upload_image(client: httpx.AsyncClient, image: bytes) -> str:
+    return await _upload(client, "image", image)
 
 
-async def upload_video(video: bytes) -> str:
-    return await _upload("video", video)
+async def upload_video(client: httpx.AsyncClient, video: Union[bytes, BinaryIO]) -> str:
+    return await _upload(client, "video", video)
@@ -28,6 +28,7 @@ class ImperialException(Exception):
 
 
 async def create_document(
+    client: httpx.AsyncClient,
     text: str,
     *,
     short_urls: bool = False,
@@ -39,25 +40,23 @@ async def create_document(
     expiration: int = 1,
     editor_array: list[str] = None
 ) -> ImperialDocument:
-    async with httpx.AsyncClient() as client:
-        r = await client.post(
-            "https://imperialb.in/api/document",
-            json={
-                "code": limit_length(text, max_length=128 * 1024),
-                "shortUrls": short_urls,
-                "longerUrls": longer_urls,
-                "language": language,
-                "imageEmbed": image_embed,
-                "instantDelete": instant_delete,
-                "encrypted": password is not None,
-                "password": password,
-                "expiration": expiration,
-                "editorArray": editor_array,
-            },
-            headers={"Authorization": environ["IMPERIAL_TOKEN"]},
-            timeout=httpx.Timeout(20),
-        )
-        json = r.json()
+    r = await client.post(
+        "https://imperialb.in/api/document",
+        json={
+            "code": limit_length(text, max_length=128 * 1024),
+            "shortUrls": short_urls,
+            "longerUrls": longer_urls,
+            "language": language,
+            "imageEmbed": image_embed,
+            "instantDelete": instant_delete,
+            "encrypted": password is not None,
+            "password": password,
+            "expiration": expiration,
+            "editorArray": editor_array,
+        },
+        headers={"Authorization": environ["IMPERIAL_TOKEN"]},
+    )
+    json = r.json()
 
     if not json["success"]:
         raise ImperialException(json["message"])
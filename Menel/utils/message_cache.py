@@ -0,0 +1,130 @@
+from collections import Counter, OrderedDict, deque
+from typing import Iterable, Iterator, Optional
+
+import discord
+
+# messages outside of guilds
+DM = 0
+
+
+# replaces the single deque of discord.py, so that a busy guild can't evict the messages of all the others
+class MessageCache:
+    def __init__(self, max_messages: int, *, max_guild_messages: Optional[int] = None) -> None:
+        self.max_messages = max_messages
+        self.max_guild_messages = max_guild_messages or max_messages
+        # guild id -> message id -> message, oldest first
+        self._guilds: dict[int, OrderedDict[int, discord.Message]] = {}
+        self._index: dict[int, OrderedDict[int, discord.Message]] = {}
+        # (source, "hit" or "miss") -> number of lookups
+        self.lookups: Counter[tuple[str, str]] = Counter()
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def __bool__(self) -> bool:
+        return True
+
+    def __iter__(self) -> Iterator[discord.Message]:
+        for messages in list(self._guilds.values()):
+            yield from list(messages.values())
+
+    def __reversed__(self) -> Iterator[discord.Message]:
+        return reversed(list(self))
+
+    @property
+    def guilds(self) -> int:
+        return len(self._guilds)
+
+    def append(self, message: discord.Message) -> None:
+        guild_id = message.guild.id if message.guild is not None else DM
+        messages = self._guilds.get(guild_id)
+        if messages is None:
+            messages = self._guilds[guild_id] = OrderedDict()
+
+        messages[message.id] = message
+        self._index[message.id] = messages
+
+        if len(messages) > self.max_guild_messages:
+            self._index.pop(messages.popitem(last=False)[0], None)
+            self.evictions += 1
+
+        if len(self._index) > self.max_messages:
+            self._trim()
+
+    def remove(self, message: discord.Message) -> None:
+        messages = self._index.pop(message.id, None)
+        if messages is None:
+            raise ValueError("message not in cache")
+        del messages[message.id]
+
+    def get(self, message_id: int) -> Optional[discord.Message]:
+        messages = self._index.get(message_id)
+        return messages[message_id] if messages is not None else None
+
+    def replace(self, messages: Iterable[discord.Message]) -> None:
+        self._guilds.clear()
+        self._index.clear()
+        for message in messages:
+            self.append(message)
+
+    # cuts the largest guilds down to an equal share, so that the cache isn't trimmed on every message
+    def _trim(self) -> None:
+        guilds = sorted(self._guilds.items(), key=lambda item: len(item[1]))
+        remaining = self.max_messages * 9 // 10
+        for i, (_, messages) in enumerate(guilds):
+            left = len(guilds) - i
+            if len(messages) * left >= remaining:
+                break
+            remaining -= len(messages)
+        else:
+            return
+
+        # the largest guilds get the messages left over after dividing the budget
+        share, extra = divmod(remaining, left)
+        for j, (guild_id, messages) in enumerate(reversed(guilds[i:])):
+            limit = share + 1 if j < extra else share
+            while len(messages) > limit:
+                self._index.pop(messages.popitem(last=False)[0], None)
+                self.evictions += 1
+            if not messages:
+                del self._guilds[guild_id]
+
+    def record(self, source: str, hit: bool) -> None:
+        self.lookups[source, "hit" if hit else "miss"] += 1
+
+    def hit_rate(self, source: str) -> float:
+        hits = self.lookups[source, "hit"]
+        total = hits + self.lookups[source, "miss"]
+        return hits / total if total else 0.0
+
+
+# checks the private parts of discord.py's ConnectionState which MessageCacheState overrides,
+# they're the same from the 2.0 development versions up to 2.0.0 but aren't a public API
+def supports_message_cache(state: object) -> bool:
+    return (
+        isinstance(vars(state).get("_messages"), deque)
+        and callable(getattr(state, "_get_message", None))
+        and callable(getattr(state, "_remove_guild", None))
+    )
+
+
+# mixed into the connection state, which replaces or resets the message deque in a few places:
+# ConnectionState.clear() and _remove_guild() assign _messages, _get_message() searches it
+class MessageCacheState:
+    message_cache: MessageCache
+
+    @property
+    def _messages(self) -> MessageCache:
+        return self.message_cache
+
+    @_messages.setter
+    def _messages(self, messages: Optional[Iterable[discord.Message]]) -> None:
+        if messages is self.message_cache:
+            return
+        self.message_cache.replace(messages or ())
+
+    def _get_message(self, message_id: Optional[int]) -> Optional[discord.Message]:
+        message = self.message_cache.get(message_id) if message_id is not None else None
+        self.message_cache.record("state", message is not None)
+        return message
@@ -0,0 +1,100 @@
+import bisect
+import math
+from collections import defaultdict
+from typing import Callable, Iterable
+
+from aiohttp import web
+
+# upper bounds of the latency buckets in seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.075, 0.1, 0.15, 0.25, 0.35, 0.5, 0.75, 1, 1.5, 2.5, 5, 10, 30, 60, math.inf)
+
+
+class Histogram:
+    __slots__ = ("buckets", "counts", "count", "sum")
+
+    def __init__(self, buckets: tuple[float, ...] = BUCKETS) -> None:
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    # interpolates inside the bucket like Prometheus' histogram_quantile()
+    def quantile(self, q: float) -> float:
+        rank = q * self.count
+        cumulative = 0
+        for i, count in enumerate(self.counts):
+            if count and cumulative + count >= rank:
+                lower = self.buckets[i - 1] if i > 0 else 0
+                upper = self.buckets[i]
+                if upper == math.inf:
+                    return lower
+                return lower + (upper - lower) * (rank - cumulative) / count
+            cumulative += count
+        return 0.0
+
+
+class CommandMetrics:
+    __slots__ = ("latency", "errors", "running", "max_running")
+
+    def __init__(self) -> None:
+        self.latency = Histogram()
+        self.errors = 0
+        self.running = 0
+        self.max_running = 0
+
+    def start(self) -> None:
+        self.running += 1
+        self.max_running = max(self.max_running, self.running)
+
+    def stop(self, duration: float, *, failed: bool) -> None:
+        self.running -= 1
+        self.latency.observe(duration)
+        if failed:
+            self.errors += 1
+
+
+class Metrics:
+    def __init__(self) -> None:
+        self.commands: defaultdict[str, CommandMetrics] = defaultdict(CommandMetrics)
+        # functions returning additional samples as (name with labels, value)
+        self.collectors: list[Callable[[], Iterable[tuple[str, float]]]] = []
+
+    def prometheus(self) -> str:
+        lines = [
+            "# TYPE menel_command_latency_seconds histogram",
+            "# TYPE menel_command_errors_total counter",
+            "# TYPE menel_command_running gauge",
+        ]
+        for name, command in self.commands.items():
+            latency = command.latency
+            cumulative = 0
+            for bucket, count in zip(latency.buckets, latency.counts):
+                cumulative += count
+                le = "+Inf" if bucket == math.inf else bucket
+                lines.append(f'menel_command_latency_seconds_bucket{{command="{name}",le="{le}"}} {cumulative}')
+            lines.append(f'menel_command_latency_seconds_sum{{command="{name}"}} {latency.sum}')
+            lines.append(f'menel_command_latency_seconds_count{{command="{name}"}} {latency.count}')
+            lines.append(f'menel_command_errors_total{{command="{name}"}} {command.errors}')
+            lines.append(f'menel_command_running{{command="{name}"}} {command.running}')
+
+        for collector in self.collectors:
+            lines.extend(f"{sample} {value}" for sample, value in collector())
+
+        return "\n".join(lines) + "\n"
+
+    async def serve(self, port: int) -> web.AppRunner:
+        async def handler(_: web.Request) -> web.Response:
+            return web.Response(text=self.prometheus(), content_type="text/plain", charset="utf-8")
+
+        app = web.Application()
+        app.router.add_get("/metrics", handler)
+
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        await web.TCPSite(runner, "127.0.0.1", port).start()
+        return runner
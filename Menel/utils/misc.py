@@ -34,6 +34,7 @@ async def get_image_url_from_message_or_reply(ctx: Context) -> Optional[str]:
         return url
 
     if ref := ctx.message.reference:
+        ctx.bot.message_cache.record("reference", ref.resolved is not None)
         msg = ref.resolved or await ctx.bot.fetch_message(ref.channel_id, ref.message_id)
         return get_image_url_from_message(msg)
 
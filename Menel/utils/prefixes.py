@@ -0,0 +1,28 @@
+from typing import Iterable, Optional
+
+# characters are never empty, so this key can't collide with the next character of a prefix
+_END = ""
+
+
+class PrefixMatcher:
+    __slots__ = ("prefixes", "_root")
+
+    def __init__(self, prefixes: Iterable[str]) -> None:
+        self.prefixes = tuple(prefixes)
+        self._root: dict = {}
+        for prefix in self.prefixes:
+            node = self._root
+            for char in prefix:
+                node = node.setdefault(char, {})
+            node[_END] = prefix
+
+    def match(self, text: str) -> Optional[str]:
+        node = self._root
+        # an empty prefix is stored at the root and matches every message
+        prefix = node.get(_END)
+        for char in text:
+            node = node.get(char)
+            if node is None:
+                break
+            prefix = node.get(_END, prefix)
+        return prefix
@@ -0,0 +1,90 @@
+import asyncio
+from dataclasses import dataclass
+from typing import Optional
+
+import httpx
+
+from .cache import MISSING, LRUCache, SingleFlight
+
+
+@dataclass
+class RedirectChain:
+    urls: list[str]
+    # why the chain was cut short: "loop", "hops" or "timeout", None if it reached a url which doesn't redirect
+    reason: Optional[str] = None
+
+    @property
+    def complete(self) -> bool:
+        return self.reason is None
+
+
+def cache_ttl(headers: httpx.Headers, default: float) -> float:
+    ttl = default
+    for directive in headers.get("Cache-Control", "").lower().split(","):
+        name, _, value = directive.strip().partition("=")
+        if name in {"no-store", "no-cache"}:
+            return 0
+        if name in {"max-age", "s-maxage"}:
+            try:
+                ttl = int(value.strip('"'))
+            except ValueError:
+                pass
+    return ttl
+
+
+class RedirectResolver:
+    def __init__(
+        self,
+        client: httpx.AsyncClient,
+        *,
+        max_hops: int = 16,
+        timeout: float = 15,
+        max_size: int = 8192,
+        default_ttl: float = 60 * 60,
+        max_ttl: float = 24 * 60 * 60,
+    ) -> None:
+        self.client = client
+        self.max_hops = max_hops
+        self.timeout = timeout
+        self.default_ttl = default_ttl
+        self.max_ttl = max_ttl
+        # url -> the url it redirects to, or None if it doesn't redirect
+        self.hops = LRUCache(max_size=max_size)
+        self.lookups = SingleFlight()
+
+    async def _fetch(self, url: str) -> Optional[str]:
+        r = await self.client.head(url, allow_redirects=False)
+        location = str(r.url.join(r.headers["Location"])) if "Location" in r.headers else None
+
+        ttl = min(cache_ttl(r.headers, self.default_ttl), self.max_ttl)
+        if ttl > 0:
+            self.hops.set(url, location, ttl=ttl)
+        return location
+
+    async def next(self, url: str) -> Optional[str]:
+        location = self.hops.get(url)
+        if location is MISSING:
+            location = await self.lookups.run(url, lambda: self._fetch(url))
+        return location
+
+    async def resolve(self, url: str) -> RedirectChain:
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.timeout
+        urls = [url]
+        while True:
+            try:
+                location = await asyncio.wait_for(self.next(url), max(deadline - loop.time(), 0))
+            except asyncio.TimeoutError:
+                return RedirectChain(urls, "timeout")
+
+            if location is None:
+                return RedirectChain(urls)
+
+            if location in urls:
+                return RedirectChain(urls, "loop")
+
+            if len(urls) >= self.max_hops:
+                return RedirectChain(urls, "hops")
+
+            urls.append(location)
+            url = location
@@ -0,0 +1,85 @@
+# CPU-bound rendering, run in worker processes, so this module shouldn't import anything heavy
+import functools
+import re
+import textwrap
+from io import BytesIO
+from math import sqrt
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+
+from .. import PATH
+
+ASCII_IMG_SIZES = {"normal": 128, "large": 256}
+ASCII_STYLES = {
+    "blocks": "█▓▒░ ",
+    "standard": "$@B%8&WM#*oahkbdpqwmZO0QLCJUYXzcvunxrjft/\\|()1{}[]?-_+~<>i!lI;:,\"^`'. ",
+    "minimal": "@%+*:=-. ",
+}
+
+ONEPAGER_MAX_TEXT_LENGTH = 512 * 1024
+ONEPAGER_MARGIN = 64
+ONEPAGER_FONT = ImageFont.truetype(str(PATH / "resources" / "Roboto-Light.ttf"), size=20)
+
+
+@functools.cache
+def ascii_lut(charset: str, invert: bool) -> np.ndarray:
+    if invert:
+        charset = charset[::-1]
+
+    codepoints = np.array([ord(c) for c in charset], dtype="<u4")
+    return codepoints[np.round(np.arange(256) / 255 * (len(charset) - 1)).astype(np.intp)]
+
+
+def image_to_ascii(image: Image, charset: str, invert: bool, resolution: int = ASCII_IMG_SIZES["normal"]) -> str:
+    if image.width >= image.height:
+        size = resolution, round((image.height / image.width) * (resolution // 2))
+    else:
+        size = round((image.width / image.height) * (resolution * 2)), resolution
+
+    image = image.resize(size, Image.LANCZOS)
+
+    if image.mode != "L":
+        if not invert:
+            white = Image.new("RGB", image.size, color=0xFFFFFF)
+            white.paste(image, mask=image)
+
+        image = image.convert("L", dither=Image.NONE)
+
+    # one UTF-32 code point per pixel and a newline at the end of each row
+    chars = np.empty((image.height, image.width + 1), dtype="<u4")
+    chars[:, :-1] = ascii_lut(charset, invert)[np.asarray(image)]
+    chars[:, -1] = ord("\n")
+
+    text = chars.tobytes().decode("utf-32-le")
+    return "".join(line.rstrip() + "\n" for line in text.splitlines())
+
+
+def ascii_art(data: bytes, charset: str, invert: bool, resolution: int) -> str:
+    return image_to_ascii(Image.open(BytesIO(data)), charset, invert, resolution)
+
+
+def prepare_text(text: str) -> str:
+    text = re.sub(r"\s+", " ", text.strip())
+    return "\n".join(
+        textwrap.wrap(
+            text,
+            width=round(sqrt(len(text)) * 1.25),
+            expand_tabs=False,
+            replace_whitespace=True,
+            drop_whitespace=True,
+            break_on_hyphens=False,
+        )
+    )
+
+
+def render_page(text: str) -> bytes:
+    size = ONEPAGER_FONT.getsize_multiline(text)
+    image = Image.new("L", (size[0] + 2 * ONEPAGER_MARGIN, size[1] + 2 * ONEPAGER_MARGIN), 0xFFFFFF)
+
+    draw = ImageDraw.Draw(image)
+    draw.multiline_text((ONEPAGER_MARGIN, ONEPAGER_MARGIN), text, fill=0, font=ONEPAGER_FONT, align="center")
+
+    file = BytesIO()
+    image.save(file, format="png", optimize=True)
+    return file.getvalue()
@@ -0,0 +1,115 @@
+import asyncio
+import logging
+import os
+import pickle
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Hashable, Optional
+
+from ..resources.filesizes import MiB
+from .cache import MISSING, LRUCache, SingleFlight
+
+log = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class Endpoint:
+    ttl: float
+    # for lookups which found nothing, None means the same as ttl
+    negative_ttl: Optional[float] = None
+    case_sensitive: bool = True
+
+
+ENDPOINTS: dict[str, Endpoint] = {
+    "translate": Endpoint(ttl=6 * 60 * 60, negative_ttl=60),
+    "urbandictionary": Endpoint(ttl=6 * 60 * 60, negative_ttl=10 * 60, case_sensitive=False),
+    "docs": Endpoint(ttl=60 * 60, negative_ttl=10 * 60, case_sensitive=False),
+    "minecraft": Endpoint(ttl=15 * 60, negative_ttl=5 * 60, case_sensitive=False),
+}
+
+
+def normalize(value: Any, *, case_sensitive: bool) -> Any:
+    if isinstance(value, str):
+        value = " ".join(value.split())
+        return value if case_sensitive else value.casefold()
+    return value
+
+
+class ResponseCache:
+    def __init__(
+        self,
+        *,
+        max_size: int = 4096,
+        max_bytes: int = 32 * MiB,
+        path: Optional[Path] = None,
+        endpoints: dict[str, Endpoint] = ENDPOINTS,
+    ) -> None:
+        self.endpoints = endpoints
+        self.path = path
+        self.cache = LRUCache(max_size=max_size, max_bytes=max_bytes)
+        self.lookups = SingleFlight()
+
+    def key(self, endpoint: str, *params: Any) -> tuple:
+        case_sensitive = self.endpoints[endpoint].case_sensitive
+        return (endpoint, *(normalize(p, case_sensitive=case_sensitive) for p in params))
+
+    async def _fetch(self, key: tuple, factory: Callable[[], Awaitable[Any]]) -> Any:
+        value = await factory()
+        endpoint = self.endpoints[key[0]]
+        ttl = endpoint.negative_ttl if value is None and endpoint.negative_ttl is not None else endpoint.ttl
+        self.cache.set(key, value, ttl=ttl)
+        return value
+
+    # the factory returns the data to cache, or None if nothing was found
+    async def get(self, endpoint: str, params: tuple, factory: Callable[[], Awaitable[Any]]) -> Any:
+        key = self.key(endpoint, *params)
+        value = self.cache.get(key)
+        if value is MISSING:
+            value = await self.lookups.run(key, lambda: self._fetch(key, factory))
+        return value
+
+    # persistence, expiration times are stored as wall clock time since the monotonic clock restarts with the system
+
+    def _load(self) -> int:
+        with open(self.path, "rb") as f:
+            entries = pickle.load(f)
+
+        now = time.time()
+        loaded = 0
+        for key, value, expires in entries:
+            if key[0] not in self.endpoints or expires <= now:
+                continue
+            self.cache.set(key, value, ttl=expires - now)
+            loaded += 1
+        return loaded
+
+    def _save(self, entries: list) -> None:
+        temp = self.path.with_suffix(".tmp")
+        with open(temp, "wb") as f:
+            pickle.dump(entries, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp, self.path)
+
+    async def load(self) -> None:
+        if self.path is None or not self.path.exists():
+            return
+
+        try:
+            loaded = await asyncio.to_thread(self._load)
+        except (OSError, pickle.UnpicklingError, EOFError, ValueError) as e:
+            log.warning(f"Couldn't load the response cache: {e}")
+            return
+        log.info(f"Loaded {loaded} cached responses")
+
+    async def save(self) -> None:
+        if self.path is None:
+            return
+
+        now = time.time()
+        entries: list[tuple[Hashable, Any, float]] = [
+            (key, value, now + ttl) for key, value, ttl in self.cache.entries() if ttl is not None
+        ]
+        try:
+            await asyncio.to_thread(self._save, entries)
+        except OSError as e:
+            log.warning(f"Couldn't save the response cache: {e}")
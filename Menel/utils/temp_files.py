@@ -0,0 +1,32 @@
+import logging
+import os
+import shutil
+from pathlib import Path
+
+from .. import PATH
+from ..resources.filesizes import MiB
+
+log = logging.getLogger(__name__)
+
+
+class TempFiles:
+    def __init__(self, path: Path = PATH / "temp", *, min_free_space: int = 256 * MiB) -> None:
+        self.path = path
+        self.min_free_space = min_free_space
+        self.path.mkdir(exist_ok=True)
+
+    # files left over after the previous run was killed
+    def cleanup(self) -> None:
+        removed = 0
+        for file in self.path.iterdir():
+            if file.is_file():
+                file.unlink(missing_ok=True)
+                removed += 1
+        if removed:
+            log.info(f"Removed {removed} orphaned temporary files")
+
+    def has_space_for(self, size: int) -> bool:
+        return shutil.disk_usage(self.path).free - size >= self.min_free_space
+
+    def template(self, suffix: str = "") -> str:
+        return str(self.path / (os.urandom(16).hex() + suffix))
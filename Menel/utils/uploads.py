@@ -0,0 +1,77 @@
+import datetime
+import hashlib
+import logging
+from typing import Awaitable, Callable
+
+import httpx
+import pymongo.errors
+
+from . import imgur, imperial
+from .cache import MISSING, LRUCache, SingleFlight
+from .database import Database
+
+log = logging.getLogger(__name__)
+
+IMGUR_LIFETIME = datetime.timedelta(days=30)
+# links which would expire sooner than this aren't reused
+MIN_LIFETIME = datetime.timedelta(hours=1)
+
+
+def content_key(service: str, data: bytes, *options: object) -> str:
+    digest = hashlib.blake2b(data, digest_size=20)
+    for option in options:
+        digest.update(b"\0" + repr(option).encode())
+    return f"{service}:{digest.hexdigest()}"
+
+
+# content hash -> link of an earlier upload of the same data
+class UploadCache:
+    def __init__(self, db: Database, *, max_size: int = 4096) -> None:
+        self.db = db
+        self.cache = LRUCache(max_size=max_size)
+        self.uploads = SingleFlight()
+        self.reused = 0
+
+    async def _upload(self, key: str, upload: Callable[[], Awaitable[tuple[str, datetime.datetime]]]) -> str:
+        # the database only saves uploads, so its errors fall back to uploading or skip saving the link
+        try:
+            stored = await self.db.get_upload(key, min_lifetime=MIN_LIFETIME)
+        except pymongo.errors.PyMongoError as e:
+            log.warning(f"Couldn't look up upload {key}: {e}")
+            stored = None
+
+        if stored is not None:
+            url, expires = stored
+            self.reused += 1
+        else:
+            url, expires = await upload()
+            try:
+                await self.db.add_upload(key, url, expires)
+            except pymongo.errors.PyMongoError as e:
+                log.warning(f"Couldn't save upload {key}: {e}")
+
+        ttl = (expires - datetime.datetime.utcnow() - MIN_LIFETIME).total_seconds()
+        if ttl > 0:
+            self.cache.set(key, url, ttl=ttl)
+        return url
+
+    async def get_or_upload(self, key: str, upload: Callable[[], Awaitable[tuple[str, datetime.datetime]]]) -> str:
+        url = self.cache.get(key)
+        if url is not MISSING:
+            self.reused += 1
+            return url
+        return await self.uploads.run(key, lambda: self._upload(key, upload))
+
+    async def imgur_image(self, client: httpx.AsyncClient, image: bytes) -> str:
+        async def upload() -> tuple[str, datetime.datetime]:
+            return await imgur.upload_image(client, image), datetime.datetime.utcnow() + IMGUR_LIFETIME
+
+        return await self.get_or_upload(content_key("imgur", image), upload)
+
+    # returns the raw link of the document
+    async def imperial_document(self, client: httpx.AsyncClient, text: str, **kwargs) -> str:
+        async def upload() -> tuple[str, datetime.datetime]:
+            document = await imperial.create_document(client, text, **kwargs)
+            return document.raw_link, document.expiration_date
+
+        return await self.get_or_upload(content_key("imperial", text.encode(), sorted(kwargs.items())), upload)
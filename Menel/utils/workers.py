@@ -0,0 +1,112 @@
+import asyncio
+import multiprocessing
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.context import ForkServerContext
+from typing import Any, Callable, Optional
+
+from .errors import WorkerPoolFull, WorkerTimeout
+
+
+# remembers the processes it starts, ProcessPoolExecutor has no public way to get its workers
+class WorkerContext(ForkServerContext):
+    def __init__(self) -> None:
+        self.processes: list[multiprocessing.Process] = []
+
+    def Process(self, *args, **kwargs) -> multiprocessing.Process:
+        process = super().Process(*args, **kwargs)
+        self.processes.append(process)
+        return process
+
+
+class WorkerExecutor(ProcessPoolExecutor):
+    def __init__(self, max_workers: int) -> None:
+        self.context = WorkerContext()
+        super().__init__(max_workers, mp_context=self.context)
+
+
+class ProcessPool:
+    def __init__(
+        self,
+        *,
+        max_workers: int = 2,
+        max_queued: int = 2,
+        max_jobs_per_executor: int = 64,
+        timeout: float = 60,
+        preload: tuple[str, ...] = (),
+    ) -> None:
+        # workers are forked from a clean process which has only imported these modules,
+        # forking the bot itself with its running threads isn't safe
+        multiprocessing.get_context("forkserver").set_forkserver_preload(list(preload))
+
+        self.max_workers = max_workers
+        self.max_jobs = max_workers + max_queued
+        self.max_jobs_per_executor = max_jobs_per_executor
+        self.timeout = timeout
+        self.jobs = 0  # queued and running jobs
+
+        self._executor = self._new_executor()
+        self._executor_jobs = 0
+        self._running: Counter[WorkerExecutor] = Counter()
+        # jobs wait for a free worker here instead of in the executor, so the timeout only covers running them
+        self._workers = asyncio.Semaphore(max_workers)
+
+    def _new_executor(self) -> WorkerExecutor:
+        return WorkerExecutor(self.max_workers)
+
+    def _retire(self) -> None:
+        executor = self._executor
+        self._executor = self._new_executor()
+        self._executor_jobs = 0
+        if not self._running[executor]:
+            self._shutdown(executor)
+
+    @staticmethod
+    def _shutdown(executor: WorkerExecutor) -> None:
+        # shutdown() can't stop a worker which is still busy with an abandoned job
+        for process in executor.context.processes:
+            if process.is_alive():
+                process.kill()
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    async def run(self, function: Callable, /, *args: Any, timeout: Optional[float] = None) -> Any:
+        if self.jobs >= self.max_jobs:
+            raise WorkerPoolFull()
+
+        self.jobs += 1
+        try:
+            async with self._workers:
+                return await self._run(function, args, timeout or self.timeout)
+        finally:
+            self.jobs -= 1
+
+    async def _run(self, function: Callable, args: tuple, timeout: float) -> Any:
+        if self._executor_jobs >= self.max_jobs_per_executor:
+            self._retire()
+
+        executor = self._executor
+        self._executor_jobs += 1
+        self._running[executor] += 1
+        try:
+            future = asyncio.wrap_future(executor.submit(function, *args))
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            # the worker is still busy with the abandoned job, so the next jobs get new workers
+            if executor is self._executor:
+                self._retire()
+            raise WorkerTimeout()
+        except asyncio.CancelledError:
+            if executor is self._executor:
+                self._retire()
+            raise
+        finally:
+            self._running[executor] -= 1
+            if not self._running[executor]:
+                del self._running[executor]
+                if executor is not self._executor:
+                    self._shutdown(executor)
+
+    def close(self) -> None:
+        for executor in {*self._running, self._executor}:
+            self._shutdown(executor)
+        self._running.clear()
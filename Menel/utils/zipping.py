@@ -0,0 +1,37 @@
+import asyncio
+import tempfile
+import zipfile
+from pathlib import Path
+from typing import BinaryIO, Optional
+
+
+# builds a zip archive in a temporary file on a worker thread
+class ZipBuilder:
+    def __init__(self, *, dir: Optional[Path] = None) -> None:
+        # a real file object, discord.File doesn't accept SpooledTemporaryFile on Python 3.10
+        self.file = tempfile.TemporaryFile(dir=dir)
+        # zipfile isn't thread-safe, so only one file is written at a time
+        self._zip = zipfile.ZipFile(self.file, "w")
+        self._lock = asyncio.Lock()
+
+    async def __aenter__(self) -> "ZipBuilder":
+        return self
+
+    async def __aexit__(self, *_) -> None:
+        self.close()
+
+    # already compressed files (PNG, GIF) are stored as they are
+    async def write(self, name: str, data: bytes, *, compress: bool = False) -> None:
+        compress_type = zipfile.ZIP_DEFLATED if compress else zipfile.ZIP_STORED
+        async with self._lock:
+            await asyncio.to_thread(self._zip.writestr, name, data, compress_type)
+
+    async def finish(self) -> BinaryIO:
+        async with self._lock:
+            await asyncio.to_thread(self._zip.close)
+        self.file.seek(0)
+        return self.file
+
+    def close(self) -> None:
+        self._zip.close()
+        self.file.close()